@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eCommerce.settings')
+# Serve the async versions of the catalog pages
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'eCommerce.asgi_urls')
 
 application = get_asgi_application()
@@ -0,0 +1,12 @@
+"""
+URL configuration used under ASGI (see asgi.py).
+
+It is eCommerce/urls.py with the async versions of the catalog pages matched first.
+"""
+from django.urls import path, include
+
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('', include('store.async_urls')),
+] + wsgi_urlpatterns
@@ -17,6 +17,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 from dotenv import load_dotenv
 import os
+import sys
 
 load_dotenv()
 
@@ -57,6 +58,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'store.middleware.ServerTimingMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,11 +71,14 @@ MIDDLEWARE = [
 
 ]
 
-ROOT_URLCONF = 'eCommerce.urls'
+# asgi.py switches to eCommerce.asgi_urls, which serves async catalog views
+ROOT_URLCONF = os.environ.get('DJANGO_ROOT_URLCONF', 'eCommerce.urls')
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timing renders for Server-Timing
+        'BACKEND': 'store.middleware.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -82,6 +87,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'store.context_processors.cart',
             ],
         },
     },
@@ -92,11 +98,81 @@ WSGI_APPLICATION = 'eCommerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Connections stay open across requests for this many seconds
+CONN_MAX_AGE = int(os.environ.get('CONN_MAX_AGE', '600'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        # A file rather than memory, so tests can use several connections at once
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    # Catalog reads, routed by store.db.CatalogRouter. The same file opened a
+    # second time, read-only; WAL mode (see store/db.py) keeps it from
+    # waiting on checkout writes
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['store.db.CatalogRouter']
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The catalog cache holds product rails and rendered catalog fragments; it uses
+# Redis when REDIS_URL is set and a per-process memory cache otherwise.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'xystus',
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+    },
+}
+
+# Each process has its own memory cache and catalog version, and a change only
+# bumps the version of the process that made it; a short timeout bounds how long
+# the others serve the old catalog
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24 if REDIS_URL else 60
+
+# Request timing
+# The fraction of requests that get a Server-Timing header and a store.timing log line.
+# None under the test runner, so its output stays the same from run to run; the
+# timing tests turn it on themselves
+
+TESTING = sys.argv[1:2] == ['test']
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get('SERVER_TIMING_SAMPLE_RATE', '0' if TESTING else '0.05'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'store.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
 # Password validation
@@ -140,6 +216,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/documents/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/documents')
 
+STORAGES = {
+    # Links uploads by content-hashed names, which store.media.serve_media caches for a year
+    'default': {'BACKEND': 'store.media.MediaStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
 PAYSTACK_PUBLIC_KEY = os.environ.get('PAYSTACK_PUBLIC_KEY')
 PAYSTACK_SECRET_KEY = os.environ.get('PAYSTACK_SECRET_KEY')
 
@@ -18,12 +18,13 @@ from django.contrib import admin
 from django.urls import path, include
 
 from django.conf import settings
-from django.conf.urls.static import static
+
+from store.media import serve_media
 
 urlpatterns = [
     path('xystusVal_admin/defender/', include('defender.urls')),
     path('xystusVal_admin/', admin.site.urls),
-    path('', include('store.urls'))
+    path('', include('store.urls')),
+    # Uploads, with content-hashed URLs, validators and ranges; see store/media.py
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:path>', serve_media, name='media'),
 ]
-
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -42,25 +42,38 @@ function addCookieItem(productId, action){
 }
 
 
+// Clicks are queued and sent together, so several quick clicks cost one request
+var pendingOperations = []
+var flushTimer = null
+
 function updateUserOrder(productId, action){
-	console.log('User is authenticated, sending data...')
-
-		var url = '/update_item/'
-
-		fetch(url, {
-			method:'POST',
-			headers:{
-				'Content-Type':'application/json',
-				'X-CSRFToken':csrftoken,
-			},
-			body:JSON.stringify({'productId':productId, 'action':action})
-		})
-		.then((response) => {
-		   return response.json();
-		})
-		.then((data) => {
-		    location.reload()
-		});
+	console.log('User is authenticated, queueing:', productId, action)
+
+	pendingOperations.push({'productId':productId, 'action':action})
+	clearTimeout(flushTimer)
+	flushTimer = setTimeout(flushCartOperations, 300)
+}
+
+function flushCartOperations(){
+	var operations = pendingOperations
+	pendingOperations = []
+
+	var url = '/update_cart/'
+
+	fetch(url, {
+		method:'POST',
+		headers:{
+			'Content-Type':'application/json',
+			'X-CSRFToken':csrftoken,
+		},
+		body:JSON.stringify({'operations':operations})
+	})
+	.then((response) => {
+	   return response.json();
+	})
+	.then((data) => {
+	    location.reload()
+	});
 }
 
 function clearCart() {
@@ -0,0 +1,181 @@
+import hashlib
+from functools import wraps
+
+from django.http import JsonResponse, QueryDict
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
+
+from .catalog_cache import cached, catalog_version
+from .filters import ProductFilter
+from .keyset import PRODUCT_ORDERINGS, KeysetPage
+from .models import Category, Product, ProductType
+
+# Read-only JSON views of the catalog under /api/v1/. Every response carries
+# an ETag made from the catalog version, so a client polling with
+# If-None-Match gets a 304 for the price of one cache lookup until a product,
+# category or product type changes. Response bodies are cached by the same
+# version, so even a changed catalog is only queried once per URL.
+API_VERSION = 'v1'
+PER_PAGE = 50
+
+# List responses leave out the description and full-size image
+SUMMARY_FIELDS = ('id', 'name', 'price', 'original_price', 'shipping', 'product_type', 'category', 'image', 'added_at')
+
+
+def catalog_etag():
+    # Strong: the bytes of a response only change when the catalog version does
+    return f'"{API_VERSION}-{catalog_version()}"'
+
+
+def catalog_resource(valid=None):
+    """Serve a catalog view read-only, revalidated against the catalog version.
+
+    ``valid(request, **kwargs)``, when given, says whether the view will find
+    what was asked for, such as an existing object or well-formed filters; an
+    invalid request goes straight to the view, so its 404 or 400 never becomes
+    a 304.
+    """
+    def decorator(view):
+        @require_safe
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag = catalog_etag()
+            response = None
+            if valid is None or valid(request, **kwargs):
+                response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            # Errors carry no ETag, so they are never revalidated
+            if 200 <= response.status_code < 300 or response.status_code == 304:
+                response.headers.setdefault('ETag', etag)
+            # Clients may keep responses but must revalidate them, which the ETag makes cheap
+            patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def list_params(filterset, order):
+    # The parameters the list understands, rebuilt from their cleaned values, so
+    # unknown parameters, spelling and order never make a new cache entry or reach a link
+    data = filterset.form.cleaned_data
+    params = QueryDict(mutable=True)
+    for name in ('product_type', 'category', 'description'):
+        if data.get(name):
+            params[name] = data[name]
+    price = data.get('price')
+    if price:
+        for suffix, value in (('min', price.start), ('max', price.stop)):
+            if value is not None:
+                params[f'price_{suffix}'] = f'{value.normalize():f}'
+    params['order'] = order
+    return params
+
+
+def query_key(params):
+    return hashlib.md5(params.urlencode().encode()).hexdigest()
+
+
+def page_link(request, page, cursor):
+    if not cursor:
+        return None
+    params = page.params.copy()
+    params[page.cursor_param] = cursor
+    return f'{request.path}?{params.urlencode()}'
+
+
+def product_summary(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'original_price': product.original_price,
+        'shipping': product.shipping,
+        'product_type': product.product_type_id,
+        'category': product.category_id,
+        'thumbnail': product.thumbnailURL,
+        'url': reverse('api_product', args=[product.id]),
+    }
+
+
+def product_data(product):
+    return {
+        **product_summary(product),
+        'description': product.description or '',
+        'digital': bool(product.digital),
+        'image': product.imageURL,
+        'srcset': product.imageSrcset,
+        'webp_srcset': product.imageWebpSrcset,
+        'added_at': product.added_at,
+    }
+
+
+def group_data(group):
+    return {'id': group.id, 'name': group.name, 'thumbnail': group.thumbnailURL}
+
+
+def list_query(request):
+    # The filterset, ordering and any errors, parsed once for both catalog_resource and the view
+    if not hasattr(request, '_list_query'):
+        filterset = ProductFilter(request.GET, queryset=Product.objects.only(*SUMMARY_FIELDS))
+        order = request.GET.get('order', 'latest')
+        errors = None
+        if not filterset.is_valid():
+            errors = filterset.errors.get_json_data()
+        elif order not in PRODUCT_ORDERINGS:
+            errors = {'order': [{'message': f'Choose one of {", ".join(PRODUCT_ORDERINGS)}.',
+                                 'code': 'invalid_choice'}]}
+        request._list_query = filterset, order, errors
+    return request._list_query
+
+
+@catalog_resource(lambda request: not list_query(request)[2])
+def product_list(request):
+    filterset, order, errors = list_query(request)
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    params = list_params(filterset, order)
+    page = KeysetPage(filterset.qs, PRODUCT_ORDERINGS[order], PER_PAGE, request.GET.get('cursor'), 'cursor', params)
+
+    def build():
+        return {
+            'results': [product_summary(product) for product in page],
+            'next': page.next_cursor(),
+            'previous': page.previous_cursor(),
+        }
+    # Keyed by the validated cursor; the links are made per request
+    data = cached('api:products', build, query_key(params), page.cursor)
+    return JsonResponse({
+        'results': data['results'],
+        'next': page_link(request, page, data['next']),
+        'previous': page_link(request, page, data['previous']),
+    })
+
+
+def cached_product(pk):
+    def build():
+        product = Product.objects.filter(pk=pk).first()
+        return product_data(product) if product else {}
+    return cached('api:product', build, pk)
+
+
+@catalog_resource(lambda request, pk: bool(cached_product(pk)))
+def product_detail(request, pk):
+    data = cached_product(pk)
+    if not data:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    return JsonResponse(data)
+
+
+@catalog_resource()
+def product_type_list(request):
+    data = cached('api:product_types', lambda: [group_data(group) for group in ProductType.objects.order_by('name')])
+    return JsonResponse({'results': data})
+
+
+@catalog_resource()
+def category_list(request):
+    data = cached('api:categories', lambda: [group_data(group) for group in Category.objects.order_by('name')])
+    return JsonResponse({'results': data})
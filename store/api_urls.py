@@ -0,0 +1,9 @@
+from django.urls import path
+from . import api
+
+urlpatterns = [
+    path('products/', api.product_list, name='api_products'),
+    path('products/<int:pk>/', api.product_detail, name='api_product'),
+    path('product-types/', api.product_type_list, name='api_product_types'),
+    path('categories/', api.category_list, name='api_categories'),
+]
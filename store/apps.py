@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        from .db import configure_sqlite
+        from .models import (
+            ResponsiveImageMixin, delete_image_derivatives, refresh_image_derivatives, remember_previous_image,
+        )
+        connection_created.connect(configure_sqlite, dispatch_uid='store.configure_sqlite')
+
+        # Only for the models with images: a receiver for every sender would cost each
+        # save of any model a call, and make every QuerySet.delete() fetch its rows first
+        for model in self.get_models():
+            if issubclass(model, ResponsiveImageMixin):
+                pre_save.connect(remember_previous_image, sender=model)
+                post_save.connect(refresh_image_derivatives, sender=model)
+                post_delete.connect(delete_image_derivatives, sender=model)
@@ -0,0 +1,12 @@
+from django.urls import path
+from . import async_views
+
+# The catalog pages that have async versions; eCommerce/asgi_urls.py puts these
+# ahead of store/urls.py, so every other URL is served by the same view as before
+urlpatterns = [
+    path('', async_views.index, name='index'),
+    path('categories/', async_views.categories, name='categories'),
+    path('shop/', async_views.shop, name='shop'),
+    path('product_detail/<str:product_id>/', async_views.productDetail, name='product_detail'),
+    path('product_type/<str:pk>/', async_views.product_type_detail, name='product_type_detail'),
+]
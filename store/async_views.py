@@ -0,0 +1,143 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.shortcuts import get_object_or_404, render
+
+from .catalog_cache import cached
+from .conditional import conditional_page, product_detail_freshness, product_type_freshness
+from .facets import FACETS
+from .filters import ProductFilter
+from .forms import SearchForm
+from .keyset import LATEST_FIRST, QUICK_PRODUCTS, cached_page, keyset_paginate
+from .middleware import instrumented
+from .models import Product, ProductType
+from .recommendations import recommended_products
+from .search import search_products
+from .utils import paginate, shuffleSeed, shuffled
+
+# Async versions of the read-only catalog pages, served under ASGI by
+# eCommerce/asgi_urls.py. Independent queries run at the same time, each on
+# a pool thread with its own database connection; views.py keeps the
+# synchronous versions that wsgi.py serves.
+
+
+def evaluate(build):
+    try:
+        with instrumented():
+            return build()
+    finally:
+        # Pool threads are shared by every request; let their connections go
+        # unless CONN_MAX_AGE says they can be reused
+        for conn in connections.all(initialized_only=True):
+            conn.close_if_unusable_or_obsolete()
+
+
+async def gather(*builds):
+    return await asyncio.gather(*(sync_to_async(evaluate, thread_sensitive=False)(build) for build in builds))
+
+
+def loaded(page):
+    # Fetch the page's rows now, on the pool thread, rather than while the template renders
+    page.object_list = list(page.object_list)
+    return page
+
+
+def rail(name, queryset, *parts):
+    return cached(f'rail:{name}', lambda: list(queryset), *parts)
+
+
+async def index(request):
+    seed = await sync_to_async(shuffleSeed)(request)
+
+    product_page, product_types, cheapest, latest_products = await gather(
+        lambda: loaded(paginate(request, shuffled(Product.objects.all(), seed), 16)),
+        lambda: rail('index:product_types', ProductType.objects.all()[:6]),
+        lambda: rail('index:cheapest', Product.objects.order_by('price')[:10]),
+        lambda: rail('index:latest_products', Product.objects.all().order_by('-added_at')[:12]),
+    )
+
+    context = {
+        'product_page': product_page,
+        'product_types': product_types,
+        'cheapest': cheapest,
+        'latest_products': latest_products,
+    }
+    return await sync_to_async(render)(request, 'store/index.html', context)
+
+
+@conditional_page(product_type_freshness)
+async def product_type_detail(request, pk):
+    product_type, products = await gather(
+        lambda: get_object_or_404(ProductType, pk=pk),
+        lambda: cached_page(
+            'product_type_detail',
+            keyset_paginate(request, Product.objects.filter(product_type_id=pk), LATEST_FIRST, 24),
+            pk,
+        ),
+    )
+
+    context = {
+        'product_type': product_type,
+        'products': products,
+    }
+    return await sync_to_async(render)(request, 'store/product_type_detail.html', context)
+
+
+async def categories(request):
+    seed = await sync_to_async(shuffleSeed)(request)
+    my_filter = ProductFilter(request.GET, queryset=Product.objects.all())
+
+    product_page, *facets = await gather(
+        lambda: loaded(paginate(request, shuffled(my_filter.qs, seed), 24)),
+        *[lambda title=title, facet=facet: {'title': title, 'entries': facet(request.GET)} for title, facet in FACETS],
+    )
+
+    context = {
+        'product_page': product_page,
+        'my_filter': my_filter,
+        'facets': facets,
+    }
+    return await sync_to_async(render)(request, 'store/categories.html', context)
+
+
+async def shop(request):
+    seed = await sync_to_async(shuffleSeed)(request)
+    query = request.GET.get('query', '')
+
+    builds = [lambda: loaded(paginate(request, shuffled(Product.objects.all(), seed), 24))]
+    if query:
+        form = SearchForm(request.GET)
+        if form.is_valid():
+            query = form.cleaned_data.get('query')
+            builds.append(lambda: loaded(paginate(request, search_products(query), 16, page_param='results_page')))
+    else:
+        form = SearchForm()
+
+    product_page, *results = await gather(*builds)
+
+    context = {
+        'product_page': product_page,
+        'results': results[0] if results else [],
+        'form': form,
+    }
+    return await sync_to_async(render)(request, 'store/shop.html', context)
+
+
+@conditional_page(product_detail_freshness)
+async def productDetail(request, product_id):
+    seed = await sync_to_async(shuffleSeed)(request, create=False)
+
+    # The recommendations look up the product's type themselves, so they need not wait for the product
+    product_detail, quick_products, explore_products = await gather(
+        lambda: Product.objects.get(id=product_id),
+        lambda: rail('product_detail:quick_products', Product.objects.order_by('pk')[:QUICK_PRODUCTS]),
+        lambda: recommended_products(product_id, seed),
+    )
+
+    context = {
+        'product_detail': product_detail,
+        'quick_products': quick_products,
+        'explore_products': explore_products,
+    }
+    return await sync_to_async(render)(request, 'store/product_detail.html', context)
@@ -0,0 +1,76 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Cached catalog data and rendered catalog fragments. Every key embeds the
+# catalog version, which changes whenever a product, category or product type
+# is saved or deleted, so stale entries are never read again and simply expire.
+CACHE_ALIAS = 'catalog'
+VERSION_KEY = 'catalog:version'
+HITS_KEY = 'catalog:hits'
+MISSES_KEY = 'catalog:misses'
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def catalog_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock rather than 1, so a flushed or evicted version
+        # can never come back as one whose keys are still cached
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    get_cache().set(VERSION_KEY, time.time_ns(), None)
+
+
+def catalog_key(name, *parts):
+    suffix = ':'.join(str(part) for part in parts)
+    return f'catalog:{catalog_version()}:{name}' + (f':{suffix}' if suffix else '')
+
+
+def count(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def cached(name, build, *parts):
+    """Return the cached value for ``name``, calling ``build`` on a miss."""
+    cache = get_cache()
+    key = catalog_key(name, *parts)
+    value = cache.get(key)
+    if value is not None:
+        count(HITS_KEY)
+        return value
+
+    count(MISSES_KEY)
+    value = build()
+    cache.set(key, value, settings.CATALOG_CACHE_TIMEOUT)
+    return value
+
+
+def cache_stats():
+    values = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits = values.get(HITS_KEY, 0)
+    misses = values.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / lookups if lookups else None,
+        'version': catalog_version(),
+    }
+
+
+def reset_cache_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,119 @@
+import csv
+import json
+import os
+import sys
+from contextlib import nullcontext
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Category, Product, ProductType
+
+# Catalog files read by import_products and written by export_products: one
+# product per CSV row or JSONL line, with the type and category given by name
+COLUMNS = ('name', 'product_type', 'category', 'description', 'original_price', 'price', 'shipping', 'digital')
+FORMATS = ('csv', 'jsonl')
+PRODUCT_FIELDS = ('name', 'description', 'original_price', 'price', 'shipping')
+TRUE = {'1', 'true', 't', 'yes', 'y'}
+FALSE = {'0', 'false', 'f', 'no', 'n', ''}
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension == 'ndjson':
+        return 'jsonl'
+    if extension not in FORMATS:
+        raise ValueError(f'Cannot tell the format of {path!r}; pass --format')
+    return extension
+
+
+def open_file(path, mode):
+    # "-" is stdin or stdout, which are left open afterwards
+    if path == '-':
+        return nullcontext(sys.stdin if 'r' in mode else sys.stdout)
+    return open(path, mode, newline='', encoding='utf-8-sig' if 'r' in mode else 'utf-8')
+
+
+def read_rows(f, fmt):
+    """Yield ``(line, row, error)`` for each record of ``f``, reading one at a time."""
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line, text in enumerate(f, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            yield line, {'raw': text.rstrip('\n')}, f'Invalid JSON: {e}'
+            continue
+        if isinstance(row, dict):
+            yield line, row, None
+        else:
+            yield line, {'raw': text.rstrip('\n')}, 'Expected a JSON object'
+
+
+class RowWriter:
+    def __init__(self, f, fmt, columns):
+        self.f = f
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(f, columns, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            self.writer.writerow(row)
+        else:
+            self.f.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+
+
+def clean_flag(value):
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in TRUE:
+        return True
+    if text in FALSE:
+        return False
+    raise ValidationError(f'"{value}" is not true or false')
+
+
+def clean_name(value):
+    return str(value).strip() if value not in (None, '') else None
+
+
+def clean_row(row):
+    """The Product values of an import row, checked with the model fields' own validation."""
+    values = {}
+    errors = []
+    for name in PRODUCT_FIELDS:
+        field = Product._meta.get_field(name)
+        raw = row.get(name)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        if raw in (None, '') and field.has_default():
+            raw = field.get_default()
+        try:
+            values[name] = field.clean(raw, None)
+        except ValidationError as e:
+            errors.append(f'{name}: {" ".join(e.messages)}')
+    try:
+        values['digital'] = clean_flag(row.get('digital'))
+    except ValidationError as e:
+        errors.append(f'digital: {" ".join(e.messages)}')
+    for name, model in (('product_type', ProductType), ('category', Category)):
+        values[name] = clean_name(row.get(name))
+        if values[name] is not None:
+            try:
+                model._meta.get_field('name').run_validators(values[name])
+            except ValidationError as e:
+                errors.append(f'{name}: {" ".join(e.messages)}')
+    if errors:
+        raise ValidationError('; '.join(errors))
+    return values
@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .keyset import QUICK_PRODUCTS
+from .models import Product, ProductType
+from .recommendations import co_purchase_freshness
+from .utils import cartCount, shuffleSeed
+
+# Conditional GET for server-rendered catalog pages. A page's freshness
+# function summarises the rows it shows with a cheap indexed query; from that
+# and the visitor's own state come an ETag and a Last-Modified, checked before
+# the view runs, so a browser or crawler revalidating an unchanged page gets a
+# 304 without the page's queries or template.
+
+
+def visitor_state(request):
+    # What a page shows that depends on the visitor rather than the catalog:
+    # the navbar's user and staff link and the cart badge
+    if not hasattr(request, '_cart_count'):
+        request._cart_count = cartCount(request)
+    return [request.user.pk, request.user.is_staff, request._cart_count]
+
+
+def validators(request, freshness, kwargs):
+    found = freshness(request, **kwargs)
+    if found is None:
+        # Let the view answer for a missing row
+        return None, None
+    last_modified, parts = found
+    digest = hashlib.md5(repr([last_modified, parts, visitor_state(request)]).encode()).hexdigest()
+    # Weak: the CSP nonce and CSRF token make the bytes of every render differ
+    etag = f'W/{quote_etag(digest)}'
+    if last_modified is not None:
+        last_modified = int(last_modified.timestamp())
+    return etag, last_modified
+
+
+def finish(request, response, etag, last_modified):
+    if request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+        if etag:
+            response.headers.setdefault('ETag', etag)
+        if last_modified:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+    if response.status_code == 304:
+        # The cached page's scripts carry the nonce of its own policy; keep that policy
+        response._csp_exempt = True
+    # Per visitor, and always revalidated
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_page(freshness):
+    """Answer conditional GETs for a view from ``freshness(request, **kwargs)``.
+
+    ``freshness`` returns ``(last_modified, parts)``, where ``parts`` covers
+    what the modification time cannot, such as rows removed from a listing, or
+    None when the page's object does not exist. Works on sync and async views.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                etag, last_modified = await sync_to_async(validators)(request, freshness, kwargs)
+                response = get_conditional_response(request, etag, last_modified)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return finish(request, response, etag, last_modified)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                etag, last_modified = validators(request, freshness, kwargs)
+                response = get_conditional_response(request, etag, last_modified)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return finish(request, response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def latest(*moments):
+    moments = [moment for moment in moments if moment is not None]
+    return max(moments) if moments else None
+
+
+# Freshness of the detail pages for conditional_page: when the rows a page
+# shows last changed, plus the row counts, which catch products removed from it
+def product_type_freshness(request, pk):
+    try:
+        updated_at = ProductType.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    except ValueError:
+        return None
+    if updated_at is None:
+        return None
+    products = Product.objects.filter(product_type=pk).aggregate(updated_at=Max('updated_at'), count=Count('id'))
+    return latest(updated_at, products['updated_at']), [pk, products['count']]
+
+
+def product_detail_freshness(request, product_id):
+    try:
+        row = Product.objects.filter(pk=product_id).annotate(**co_purchase_freshness()).values_list(
+            'updated_at', 'product_type', 'product_type__updated_at', 'category__updated_at',
+            'co_purchase_updated_at', 'co_purchase_score',
+        ).first()
+    except ValueError:
+        return None
+    if row is None:
+        return None
+    updated_at, product_type, product_type_updated_at, category_updated_at, co_purchase_updated_at, co_purchase_score = row
+    # The quick rail, the recommendations and the rail of the product's type (their fallback) show other products
+    rails = Product.objects.filter(
+        Q(product_type=product_type) | Q(pk__in=Product.objects.order_by('pk').values('pk')[:QUICK_PRODUCTS])
+    ).aggregate(updated_at=Max('updated_at'), count=Count('id'))
+    return (
+        latest(updated_at, product_type_updated_at, category_updated_at, co_purchase_updated_at, rails['updated_at']),
+        [product_id, rails['count'], co_purchase_score, shuffleSeed(request, create=False)],
+    )
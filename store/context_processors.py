@@ -0,0 +1,13 @@
+from django.utils.functional import SimpleLazyObject
+
+from .utils import cartCount
+
+
+def cart(request):
+    # cartItems for the navbar badge, computed once per request and only if a template reads it
+    def count():
+        if not hasattr(request, '_cart_count'):
+            request._cart_count = cartCount(request)
+        return request._cart_count
+
+    return {'cartItems': SimpleLazyObject(count)}
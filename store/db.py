@@ -0,0 +1,70 @@
+from django.db import connections
+
+# The aliases in settings.DATABASES. Both open the same SQLite file; the read
+# connection is refused writes, and in WAL mode it never waits for the writer.
+WRITE_ALIAS = 'default'
+READ_ALIAS = 'replica'
+
+# Read-only catalog models whose queries may use the read connection
+CATALOG_MODELS = {'product', 'producttype', 'category'}
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    # Durable at every checkpoint rather than every commit, which WAL makes safe
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('busy_timeout', 5000),
+    ('temp_store', 'MEMORY'),
+)
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    # connection_created receiver, connected in StoreConfig.ready()
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if connection.alias == READ_ALIAS:
+            cursor.execute('PRAGMA query_only = ON')
+
+
+def lock_for_write(model, using=WRITE_ALIAS):
+    # SQLite has no row locks and begins transactions deferred, so one that reads
+    # before it writes fails with "database is locked" if another writer commits
+    # in between. A write that changes nothing takes the write lock up front
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {table} SET {pk} = {pk} WHERE 0')
+
+
+class CatalogRouter:
+    """Send catalog reads to the read connection and everything else to the writer."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'store' or model._meta.model_name not in CATALOG_MODELS:
+            return None
+        if READ_ALIAS not in connections.settings:
+            return None
+        # A transaction must see its own writes, so inside one the writer serves reads too
+        if connections[WRITE_ALIAS].in_atomic_block:
+            return WRITE_ALIAS
+        return READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return WRITE_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database
+        if {obj1._state.db, obj2._state.db} <= {WRITE_ALIAS, READ_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == READ_ALIAS:
+            return False
+        return None
@@ -0,0 +1,95 @@
+from decimal import Decimal
+
+from django.db.models import Count, Q
+
+from .filters import ProductFilter, category_choices, product_type_choices
+from .models import Product
+
+# Facet counts for the category browse page. Each facet is counted over the
+# products matching every other selected filter, so its counts say how many
+# results picking that value would give. One grouped query per facet.
+PRICE_BUCKETS = (
+    (Decimal('0'), Decimal('5000')),
+    (Decimal('5000'), Decimal('20000')),
+    (Decimal('20000'), Decimal('100000')),
+    (Decimal('100000'), None),
+)
+PRICE_PARAMS = ('price_min', 'price_max')
+
+
+def others_filtered(params, own):
+    # The products matching every selected filter except this facet's own
+    params = params.copy()
+    for key in own:
+        params.pop(key, None)
+    return ProductFilter(params, queryset=Product.objects.all()).qs.order_by()
+
+
+def link(params, changes):
+    params = params.copy()
+    params.pop('page', None)
+    for key, value in changes.items():
+        params.pop(key, None)
+        if value not in (None, ''):
+            params[key] = value
+    return params.urlencode()
+
+
+def choice_facet(params, field, choices):
+    counts = dict(
+        others_filtered(params, [field]).values_list(field).annotate(count=Count('id')).values_list(field, 'count')
+    )
+    selected = params.get(field, '')
+    entries = []
+    for value, label in choices():
+        count = counts.get(value, 0)
+        is_selected = str(value) == selected
+        if count or is_selected:
+            entries.append({
+                'label': label,
+                'count': count,
+                'selected': is_selected,
+                'query': link(params, {field: '' if is_selected else value}),
+            })
+    return entries
+
+
+def product_type_facet(params):
+    return choice_facet(params, 'product_type', product_type_choices)
+
+
+def category_facet(params):
+    return choice_facet(params, 'category', category_choices)
+
+
+def price_facet(params):
+    buckets = {}
+    for i, (low, high) in enumerate(PRICE_BUCKETS):
+        condition = Q(price__gte=low) if high is None else Q(price__gte=low, price__lt=high)
+        buckets[f'bucket_{i}'] = Count('id', filter=condition)
+    counts = others_filtered(params, PRICE_PARAMS).aggregate(**buckets)
+
+    entries = []
+    for i, (low, high) in enumerate(PRICE_BUCKETS):
+        # The price RangeFilter includes both ends, so stop a kobo short of the next bucket
+        low_param, high_param = str(low), '' if high is None else str(high - Decimal('0.01'))
+        is_selected = (params.get('price_min', ''), params.get('price_max', '')) == (low_param, high_param)
+        entries.append({
+            'label': f'₦{low:,.0f}+' if high is None else f'₦{low:,.0f} – ₦{high:,.0f}',
+            'count': counts[f'bucket_{i}'],
+            'selected': is_selected,
+            'query': link(params, {'price_min': '' if is_selected else low_param,
+                                   'price_max': '' if is_selected else high_param}),
+        })
+    return entries
+
+
+FACETS = (
+    ('Product type', product_type_facet),
+    ('Category', category_facet),
+    ('Price', price_facet),
+)
+
+
+def facet_counts(params):
+    return [{'title': title, 'entries': facet(params)} for title, facet in FACETS]
@@ -1,7 +1,17 @@
 import django_filters
+from .catalog_cache import cached
 from .models import *
 
 
+def product_type_choices():
+    # Facet choices come from the catalog cache, so rendering the dropdowns costs no queries
+    return cached('choices:product_types', lambda: list(ProductType.objects.order_by('name').values_list('id', 'name')))
+
+
+def category_choices():
+    return cached('choices:categories', lambda: list(Category.objects.order_by('name').values_list('id', 'name')))
+
+
 class CustomCharFilter(django_filters.CharFilter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -9,6 +19,8 @@ class CustomCharFilter(django_filters.CharFilter):
 
 
 class ProductFilter(django_filters.FilterSet):
+    product_type = django_filters.ChoiceFilter(choices=product_type_choices, label='Product type')
+    category = django_filters.ChoiceFilter(choices=category_choices, label='Category')
     price = django_filters.RangeFilter(
         label='Price range (Enter Only Numbers)',
         widget=django_filters.widgets.RangeWidget(attrs={'class': 'form-control'})
@@ -27,3 +39,18 @@ class ProductPage(django_filters.FilterSet):
     class Meta:
         model = Product
         fields = ['product_type', 'category', 'name', ]
+
+
+class OrderFilter(django_filters.FilterSet):
+    complete = django_filters.BooleanFilter(
+        label='Complete??',
+        widget=django_filters.widgets.BooleanWidget(attrs={'class': 'form-control'}),
+    )
+    date_ordered = django_filters.DateFromToRangeFilter(
+        label='Date ordered (YYYY-MM-DD)',
+        widget=django_filters.widgets.DateRangeWidget(attrs={'class': 'form-control', 'type': 'date'}),
+    )
+
+    class Meta:
+        model = Order
+        fields = ['complete', 'date_ordered', ]
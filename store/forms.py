@@ -15,37 +15,19 @@ class SearchForm(forms.Form):
     )
 
 
+# Duplicate names (in any letter case) are rejected by the unique constraints
+# on the models, which ModelForm validation checks with one indexed query
 class ProductTypeForm(forms.ModelForm):
     class Meta:
         model = ProductType
         fields = '__all__'
 
-    def clean(self):
-        super(ProductTypeForm, self).clean()
-        name = self.cleaned_data.get('name')
-
-        # Double Value Validation
-        for instance in ProductType.objects.all():
-            if instance.name == name:
-                raise forms.ValidationError(f'{name} already exist')
-        return self.cleaned_data
-
 
 class CategoryForm(forms.ModelForm):
     class Meta:
         model = Category
         fields = '__all__'
 
-    def clean(self):
-        super(CategoryForm, self).clean()
-        name = self.cleaned_data.get('name')
-
-        # Double Value Validation
-        for instance in Category.objects.all():
-            if instance.name == name:
-                raise forms.ValidationError(f'{name} already exist')
-        return self.cleaned_data
-
 
 class AddProductForm(forms.ModelForm):
     class Meta:
@@ -61,16 +43,6 @@ class AddProductForm(forms.ModelForm):
             else:
                 field.widget.attrs['class'] = 'form-control form-control-md'
 
-    def clean(self):
-        super(AddProductForm, self).clean()
-        name = self.cleaned_data.get('name')
-
-        # Double Value Validation
-        for instance in Product.objects.all():
-            if instance.name == name:
-                raise forms.ValidationError(f'{name} already exist')
-        return self.cleaned_data
-
 
 class UpdateProductForm(forms.ModelForm):
     class Meta:
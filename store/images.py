@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Resized copies of every uploaded image, saved next to the original as
+# <stem>_<extension>_w<width>.webp plus a JPEG (PNG when the original is a
+# PNG) fallback. They are made on upload and by the generate_image_derivatives
+# command, never while a page renders; until they exist pages use the original.
+WIDTHS = (120, 320, 640)
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+# The most recently used originals whose derivatives are known to exist in this
+# process, so pages only touch storage once for each. Missing ones are checked
+# again, since the command may make them in another process
+CHECKED_LIMIT = 10000
+_checked = OrderedDict()
+_checked_lock = threading.Lock()
+
+
+def fallback_extension(name):
+    return '.png' if name.lower().endswith('.png') else '.jpg'
+
+
+def derivative_name(name, width, webp=False):
+    # The original's extension stays in the name, so car.jpg, car.jpeg and car.png get copies of their own
+    stem, original_extension = os.path.splitext(name)
+    if original_extension:
+        stem = f'{stem}_{original_extension[1:].lower()}'
+    extension = '.webp' if webp else fallback_extension(name)
+    return f'{stem}_w{width}{extension}'
+
+
+def derivative_names(name):
+    return [derivative_name(name, width, webp) for width in WIDTHS for webp in (False, True)]
+
+
+def encode(image, extension):
+    buffer = BytesIO()
+    if extension == '.webp':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+    elif extension == '.png':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_derivatives(storage, name):
+    try:
+        with storage.open(name) as source, Image.open(source) as original:
+            original = ImageOps.exif_transpose(original)
+            if original.mode not in ('RGB', 'RGBA', 'L'):
+                original = original.convert('RGBA')
+
+            for width in WIDTHS:
+                resized = original.copy()
+                # thumbnail() only ever shrinks, so small originals are copied at their own size
+                resized.thumbnail((width, width * 4), Image.LANCZOS)
+                for webp in (False, True):
+                    target = derivative_name(name, width, webp)
+                    storage.delete(target)
+                    storage.save(target, encode(resized, os.path.splitext(target)[1]))
+    except (OSError, UnidentifiedImageError):
+        forget(name)
+        return False
+
+    remember(name)
+    return True
+
+
+def remember(name):
+    with _checked_lock:
+        _checked[name] = True
+        _checked.move_to_end(name)
+        if len(_checked) > CHECKED_LIMIT:
+            _checked.popitem(last=False)
+
+
+def forget(name):
+    with _checked_lock:
+        _checked.pop(name, None)
+
+
+def delete_derivatives(storage, name):
+    forget(name)
+    for target in derivative_names(name):
+        storage.delete(target)
+
+
+def has_derivatives(storage, name):
+    with _checked_lock:
+        if name in _checked:
+            _checked.move_to_end(name)
+            return True
+    if not storage.exists(derivative_name(name, WIDTHS[-1], webp=True)):
+        return False
+    remember(name)
+    return True
+
+
+def derivative_url(storage, name, width, webp=False):
+    if not name:
+        return ''
+    if not has_derivatives(storage, name):
+        return storage.url(name)
+    return storage.url(derivative_name(name, width, webp))
+
+
+def srcset(storage, name, webp=False):
+    if not name or not has_derivatives(storage, name):
+        return ''
+    return ', '.join(f'{storage.url(derivative_name(name, width, webp))} {width}w' for width in WIDTHS)
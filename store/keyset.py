@@ -0,0 +1,163 @@
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from .catalog_cache import cached
+
+# Keyset (cursor) pagination. A page is found by seeking past the sort key of
+# the last row shown, which an index on the ordering answers directly, so page
+# 500 costs what page 1 does; OFFSET has to walk every row before it.
+#
+# An ordering is a tuple of field names, all ascending or all descending, that
+# ends with a unique field (usually "id") so every row has its own position:
+# ('-added_at', '-id') or ('price', 'id'). None of the fields may be null.
+CURSOR_SALT = 'store.keyset'
+
+# The catalog's product orderings; each ends in id so every product has its own place
+LATEST_FIRST = ('-added_at', '-id')
+PRODUCT_ORDERINGS = {
+    'latest': LATEST_FIRST,
+    'price': ('price', 'id'),
+}
+# The product page's rail of the first products, shown by sync and async views alike
+QUICK_PRODUCTS = 8
+
+
+def cursor_salt(ordering):
+    # A cursor only means something in the ordering it was made for
+    return f'{CURSOR_SALT}:{",".join(ordering)}'
+
+
+def encode_cursor(ordering, values, backwards):
+    return signing.Signer(salt=cursor_salt(ordering)).sign_object([values, backwards])
+
+
+def decode_cursor(token, ordering, fields):
+    # A missing, tampered or foreign cursor gives the first page, as Paginator.get_page does for a bad number
+    if not token:
+        return None
+    try:
+        values, backwards = signing.Signer(salt=cursor_salt(ordering)).unsign_object(token)
+        if len(values) != len(fields):
+            return None
+        return [field.to_python(value) for field, value in zip(fields, values)], bool(backwards)
+    except (signing.BadSignature, ValidationError, TypeError, ValueError):
+        return None
+
+
+def seek(names, values, lookup):
+    # (a, b) > (x, y) as "a >= x AND (a > x OR (a = x AND b > y))"; the leading
+    # range on the first column is what lets SQLite start inside the index
+    after = Q()
+    for i, name in enumerate(names):
+        after |= Q(**dict(zip(names[:i], values[:i])), **{f'{name}__{lookup}': values[i]})
+    return Q(**{f'{names[0]}__{lookup}e': values[0]}) & after
+
+
+class KeysetPage:
+    """One page of a queryset in a fixed ordering, with cursors to its neighbours.
+
+    The rows are fetched on first use, so a page whose rendering is cached
+    costs no query.
+    """
+
+    def __init__(self, queryset, ordering, per_page, token='', cursor_param='cursor', params=None):
+        descending = {name.startswith('-') for name in ordering}
+        if len(descending) != 1:
+            raise ValueError('A keyset ordering must be all ascending or all descending')
+        self.descending = descending.pop()
+        self.names = [name.lstrip('-') for name in ordering]
+        self.fields = [queryset.model._meta.get_field(name) for name in self.names]
+
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.position = decode_cursor(token, self.ordering, self.fields)
+        # A bad cursor is the first page, and is never used as a cache key or in a link
+        self.cursor = token if self.position is not None else ''
+        self.cursor_param = cursor_param
+        self.params = params.copy() if params is not None else None
+        if self.params is not None:
+            self.params.pop(cursor_param, None)
+        self.page_query = self.params.urlencode() if self.params is not None else ''
+
+    def fetch(self):
+        if self.queryset is None:
+            return self
+
+        position = self.position
+        backwards = position is not None and position[1]
+        ordering = self.ordering
+        if backwards:
+            ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+        queryset = self.queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(seek(self.names, position[0], 'lt' if self.descending != backwards else 'gt'))
+
+        # One row more than the page says whether there is anything beyond it
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        self._object_list = rows
+        self._has_next = (position is not None) if backwards else more
+        self._has_previous = more if backwards else position is not None
+        # Keep only plain data, so a fetched page can be cached
+        self.queryset = None
+        return self
+
+    def state(self):
+        # What fetch() found, without anything taken from the request
+        self.fetch()
+        return self._object_list, self._has_next, self._has_previous
+
+    def restore(self, state):
+        self._object_list, self._has_next, self._has_previous = state
+        self.queryset = None
+        return self
+
+    @property
+    def object_list(self):
+        return self.fetch()._object_list
+
+    @property
+    def has_next(self):
+        return bool(self.object_list) and self._has_next
+
+    @property
+    def has_previous(self):
+        return bool(self.object_list) and self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def key(self, row):
+        return [field.value_to_string(row) for field in self.fields]
+
+    def next_cursor(self):
+        return encode_cursor(self.ordering, self.key(self.object_list[-1]), False) if self.has_next else ''
+
+    def previous_cursor(self):
+        return encode_cursor(self.ordering, self.key(self.object_list[0]), True) if self.has_previous else ''
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_paginate(request, queryset, ordering, per_page, cursor_param='cursor'):
+    """The page of ``queryset`` that the cursor in ``request.GET`` points at."""
+    return KeysetPage(queryset, ordering, per_page, request.GET.get(cursor_param), cursor_param, request.GET)
+
+
+def cached_page(name, page, *parts):
+    """Fetch ``page`` through the catalog cache, keyed by ``parts`` and its cursor.
+
+    Only the rows and whether the page has neighbours are cached; the links
+    are still built from the request's own page.
+    """
+    return page.restore(cached(f'keyset:{name}', page.state, *parts, page.cursor))
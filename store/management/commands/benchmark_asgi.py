@@ -0,0 +1,120 @@
+import asyncio
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from store.models import Product, ProductType
+
+URLCONFS = (
+    ('sync', 'eCommerce.urls'),
+    ('async', 'eCommerce.asgi_urls'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of the sync and async catalog views under the ASGI handler, '
+            'with many clients requesting pages at once. Run seed_catalog first for realistic numbers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per mode, shared by the clients.')
+        parser.add_argument('--paths', nargs='+', help='Paths to cycle through; defaults to the async catalog pages.')
+        parser.add_argument('--output', help='Write the results as JSON to this file, or - for stdout.')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.default_paths()
+        application = get_asgi_application()
+
+        results = {}
+        for mode, urlconf in URLCONFS:
+            with override_settings(ROOT_URLCONF=urlconf, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                                   SERVER_TIMING_SAMPLE_RATE=0):
+                results[mode] = asyncio.run(self.drive(application, paths, options['clients'], options['requests']))
+
+        report = {'clients': options['clients'], 'paths': paths, 'modes': results}
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        self.stdout.write(f'{"mode":<8}{"requests":>10}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}')
+        for mode, result in results.items():
+            self.stdout.write(
+                f'{mode:<8}{result["requests"]:>10}{result["errors"]:>8}{result["requests_per_second"]:>9.1f}'
+                f'{result["p50_ms"]:>9.1f}{result["p95_ms"]:>9.1f}'
+            )
+
+    def default_paths(self):
+        product = Product.objects.order_by('pk').first()
+        product_type = ProductType.objects.order_by('pk').first()
+        if product is None or product_type is None:
+            raise CommandError('The catalog is empty; run seed_catalog first')
+        return ['/', '/shop/', f'/product_detail/{product.pk}/', f'/product_type/{product_type.pk}/']
+
+    async def drive(self, application, paths, clients, total):
+        # Every client gets its session first, so the timed requests do not each create one
+        cookies = await asyncio.gather(*(self.request(application, paths[0]) for _ in range(clients)))
+        cookies = [cookie for status, cookie in cookies]
+
+        pending = iter(range(total))
+        timings = []
+        errors = 0
+
+        async def client(cookie):
+            nonlocal errors
+            for i in pending:
+                started = time.perf_counter()
+                status, _ = await self.request(application, paths[i % len(paths)], cookie)
+                timings.append((time.perf_counter() - started) * 1000)
+                if status >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(cookie) for cookie in cookies))
+        elapsed = time.perf_counter() - started
+
+        timings.sort()
+        return {
+            'requests': len(timings),
+            'errors': errors,
+            'seconds': elapsed,
+            'requests_per_second': len(timings) / elapsed if elapsed else 0,
+            'p50_ms': statistics.median(timings) if timings else 0,
+            'p95_ms': timings[max(0, round(0.95 * len(timings)) - 1)] if timings else 0,
+        }
+
+    async def request(self, application, path, cookie=''):
+        path, _, query = path.partition('?')
+        headers = [(b'host', b'testserver')]
+        if cookie:
+            headers.append((b'cookie', cookie.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        response = {'status': 500, 'cookie': cookie}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client never disconnects early
+            await asyncio.Future()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                for name, value in message['headers']:
+                    if name.lower() == b'set-cookie' and value.startswith(b'sessionid='):
+                        response['cookie'] = value.decode().split(';')[0]
+
+        await application(scope, receive, send)
+        return response['status'], response['cookie']
@@ -0,0 +1,82 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from store.models import Product
+from store.search import ProductSearch, fts_available, rebuild_index
+
+WORDS = (
+    'laptop notebook elitebook probook mercedes benz sedan coupe headphones wireless bluetooth '
+    'leather watch analog digital shirt cotton shoes running nivea lotion book novel source code '
+    'charger battery screen keyboard memory storage engine leather seats sunroof navigation '
+    'premium classic sport compact portable durable lightweight original genuine warranty'
+).split()
+
+
+class Command(BaseCommand):
+    help = ('Compare full-text search with the old icontains search on a generated catalog. '
+            'Everything runs inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--queries', nargs='+', default=['elitebook', 'leather seats', 'wireless headphones', 'zzz'])
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError('Full-text search needs the SQLite database backend')
+
+        with transaction.atomic():
+            self.populate(options['products'], options['seed'])
+            self.run(options['queries'], options['repeat'])
+            transaction.set_rollback(True)
+
+    def populate(self, count, seed):
+        rng = random.Random(seed)
+        # Pad the descriptions with filler words so search terms are about as selective as in a real catalog
+        syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'da', 'po', 'xi']
+        vocabulary = list(WORDS) + [''.join(rng.choices(syllables, k=4)) for _ in range(5000)]
+
+        self.stdout.write(f'Generating {count} products...')
+        batch = []
+        for i in range(count):
+            batch.append(Product(
+                name=' '.join(rng.choices(WORDS, k=3)) + f' {i}',
+                description=' '.join(rng.choices(vocabulary, k=rng.randint(20, 120))),
+                original_price=100,
+                price=rng.randint(1, 100),
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+        rebuild_index()
+
+    def run(self, queries, repeat):
+        self.stdout.write(f'{"query":<24}{"icontains ms":>14}{"fts ms":>10}{"matches":>10}')
+        for query in queries:
+            icontains = self.time(lambda: self.icontains_page(query), repeat)
+            fts = self.time(lambda: self.fts_page(query), repeat)
+            matches = ProductSearch(query).count()
+            self.stdout.write(f'{query:<24}{icontains:>14.1f}{fts:>10.1f}{matches:>10}')
+
+    def icontains_page(self, query):
+        results = Product.objects.filter(Q(name__icontains=query) | Q(description__icontains=query))
+        return results.count(), list(results[:16])
+
+    def fts_page(self, query):
+        results = ProductSearch(query)
+        return results.count(), results[:16]
+
+    def time(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,189 @@
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from store.models import Customer, Order, Product, ProductType
+from store.urls import urlpatterns
+
+
+def url_names(patterns):
+    # Names of every URL, including those of included URLconfs such as the API
+    names = []
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            names += url_names(pattern.url_patterns)
+        else:
+            names.append(pattern.name)
+    return names
+
+
+class Command(BaseCommand):
+    help = ('Request every store URL through the test client and report queries, p50/p95 latency and '
+            'peak memory per view. Everything runs inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--as', dest='role', choices=['guest', 'customer', 'staff'], default='customer',
+                            help='Who requests the public pages; staff pages always run as staff.')
+        parser.add_argument('--views', nargs='+', help='Only benchmark these URL names.')
+        parser.add_argument('--output', help='Write the results as JSON to this file, or - for stdout.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        product = Product.objects.order_by('pk').first()
+        product_type = ProductType.objects.order_by('pk').first()
+        if product is None or product_type is None:
+            raise CommandError('The catalog is empty; run seed_catalog first')
+
+        # The test client calls itself testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), transaction.atomic():
+            results = self.run(product, product_type, options)
+            transaction.set_rollback(True)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'role': options['role'],
+            'repeat': options['repeat'],
+            'products': Product.objects.count(),
+            'orders': Order.objects.count(),
+            'views': results,
+        }
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        self.stdout.write(f'{"view":<22}{"status":>7}{"queries":>9}{"p50 ms":>9}{"p95 ms":>9}{"peak KiB":>10}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<22}{result["status"]:>7}{result["queries"]:>9}{result["p50_ms"]:>9.1f}'
+                f'{result["p95_ms"]:>9.1f}{result["peak_kib"]:>10.0f}'
+            )
+
+    def requests(self, product, product_type):
+        # How to call each URL name in store/urls.py: (method, url kwargs, JSON body, needs staff)
+        cart = [{'productId': product.pk, 'action': 'add'}]
+        checkout = {
+            'form': {'name': 'Bench', 'phone': '0800', 'email': 'bench@example.com', 'total': '0'},
+            'shipping': {'phone': '0800', 'email': 'bench@example.com', 'address': '1 Road',
+                         'town': 'Ikeja', 'lga': 'Ikeja', 'state': 'Lagos'},
+        }
+        return {
+            'index': ('get', {}, None, False),
+            'categories': ('get', {}, None, False),
+            'cart': ('get', {}, None, False),
+            'shop': ('get', {}, None, False),
+            'order': ('get', {}, None, True),
+            'sales': ('get', {}, None, True),
+            'contact': ('get', {}, None, False),
+            'checkout': ('get', {}, None, False),
+            'clear_cart': ('post', {}, {}, False),
+            'update_item': ('post', {}, cart[0], False),
+            'update_cart': ('post', {}, {'operations': cart}, False),
+            'process_order': ('post', {}, checkout, False),
+            'product_detail': ('get', {'product_id': product.pk}, None, False),
+            'product_type_detail': ('get', {'pk': product_type.pk}, None, False),
+            'product': ('get', {}, None, True),
+            'addProduct': ('get', {}, None, True),
+            'updateProduct': ('get', {'product_id': product.pk}, None, True),
+            'addCategory': ('get', {}, None, True),
+            'addProductType': ('get', {}, None, True),
+            'api_products': ('get', {}, None, False),
+            'api_product': ('get', {'pk': product.pk}, None, False),
+            'api_product_types': ('get', {}, None, False),
+            'api_categories': ('get', {}, None, False),
+        }
+
+    def clients(self, role, product):
+        staff = User.objects.create_user('benchmark-staff', is_staff=True)
+        Customer.objects.create(user=staff, name='Benchmark staff')
+        # A view that fails is reported with its status code rather than ending the run
+        staff_client = Client(raise_request_exception=False)
+        staff_client.force_login(staff)
+
+        client = Client(raise_request_exception=False)
+        if role == 'staff':
+            client = staff_client
+        elif role == 'customer':
+            customer = Customer.objects.filter(user__isnull=False, user__is_staff=False).first()
+            if customer is None:
+                raise CommandError('There are no customer accounts; run seed_catalog first')
+            client.force_login(customer.user)
+        else:
+            client.cookies['cart'] = json.dumps({str(product.pk): {'quantity': 2}})
+        return client, staff_client
+
+    def run(self, product, product_type, options):
+        specs = self.requests(product, product_type)
+        names = url_names(urlpatterns)
+        missing = [name for name in names if name not in specs]
+        if missing:
+            raise CommandError(f'No benchmark request defined for: {", ".join(missing)}')
+        if options['views']:
+            names = [name for name in names if name in options['views']]
+
+        client, staff_client = self.clients(options['role'], product)
+        results = {}
+        for name in names:
+            method, kwargs, body, needs_staff = specs[name]
+            url = reverse(name, kwargs=kwargs)
+            caller = staff_client if needs_staff else client
+
+            def call():
+                if method == 'get':
+                    return caller.get(url)
+                return caller.post(url, json.dumps(body), content_type='application/json')
+
+            for _ in range(options['warmup']):
+                call()
+
+            timings = []
+            for _ in range(options['repeat']):
+                # Counted with a wrapper: each request resets connection.queries
+                queries = []
+                with connection.execute_wrapper(self.record(queries)):
+                    started = time.perf_counter()
+                    response = call()
+                    timings.append((time.perf_counter() - started) * 1000)
+
+            # Measured on its own pass, since tracing allocations slows everything down
+            tracemalloc.start()
+            call()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[name] = {
+                'url': url,
+                'method': method.upper(),
+                'status': response.status_code,
+                'queries': len(queries),
+                'p50_ms': statistics.median(timings),
+                'p95_ms': self.percentile(timings, 95),
+                'peak_kib': peak / 1024,
+            }
+        return results
+
+    def record(self, queries):
+        def wrapper(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+        return wrapper
+
+    def percentile(self, values, percent):
+        ordered = sorted(values)
+        index = max(0, round(percent / 100 * len(ordered)) - 1)
+        return ordered[index]
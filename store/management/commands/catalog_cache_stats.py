@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from store.catalog_cache import bump_catalog_version, cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show the catalog cache hit ratio, optionally resetting the counters or invalidating the cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the hit and miss counters afterwards.')
+        parser.add_argument('--invalidate', action='store_true', help='Bump the catalog version.')
+
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        ratio = 'n/a' if stats['hit_ratio'] is None else f"{stats['hit_ratio']:.1%}"
+        self.stdout.write(f"hits={stats['hits']} misses={stats['misses']} hit_ratio={ratio} version={stats['version']}")
+        if options['reset']:
+            reset_cache_stats()
+        if options['invalidate']:
+            bump_catalog_version()
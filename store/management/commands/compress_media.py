@@ -0,0 +1,43 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from whitenoise.compress import Compressor
+
+from store.media import ENCODINGS, same_mtime
+
+
+class Command(BaseCommand):
+    help = ('Write gzip (and Brotli, if the brotli package is installed) copies of compressible files under '
+            'MEDIA_ROOT, which serve_media sends to clients that accept them. Images and other already '
+            'compressed formats are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Compress files whose copies are already current.')
+
+    def handle(self, *args, **options):
+        compressor = Compressor(quiet=True)
+        suffixes = tuple(suffix for encoding, suffix in ENCODINGS)
+        made = skipped = 0
+        for root, dirs, files in os.walk(settings.MEDIA_ROOT):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if filename.endswith(suffixes) or not compressor.should_compress(filename):
+                    continue
+                if not options['force'] and self.current(path):
+                    skipped += 1
+                    continue
+                # Compressor gives each copy its source's mtime, which is how serve_media knows it is current
+                written = list(compressor.compress(path))
+                made += bool(written)
+        self.stdout.write(self.style.SUCCESS(f'Compressed {made}, skipped {skipped}'))
+
+    def current(self, path):
+        source = os.stat(path)
+        for encoding, suffix in ENCODINGS:
+            try:
+                if same_mtime(os.stat(path + suffix), source):
+                    return True
+            except OSError:
+                pass
+        return False
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from store import images
+from store.models import Category, Product, ProductType
+
+
+class Command(BaseCommand):
+    help = 'Create the resized and WebP copies of every product, category and product type image.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate copies that already exist.')
+
+    def handle(self, *args, **options):
+        made = skipped = failed = 0
+        for model in (Product, Category, ProductType):
+            storage = model._meta.get_field('image').storage
+            names = model.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True).distinct()
+            for name in names.iterator():
+                if not options['force'] and storage.exists(images.derivative_name(name, images.WIDTHS[-1], webp=True)):
+                    skipped += 1
+                elif images.generate_derivatives(storage, name):
+                    made += 1
+                else:
+                    failed += 1
+                    self.stderr.write(f'Could not read {name}')
+        self.stdout.write(self.style.SUCCESS(f'Generated {made}, skipped {skipped}, failed {failed}'))
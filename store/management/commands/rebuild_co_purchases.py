@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from store.recommendations import RELATED_PER_PRODUCT, rebuild
+
+
+class Command(BaseCommand):
+    help = ('Recompute the "frequently bought together" index behind the product detail recommendations from '
+            f'the completed orders, keeping the best {RELATED_PER_PRODUCT} for each product. Checkout keeps it up '
+            'to date; run this for the existing history, and now and then to trim it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        pairs = rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {pairs} co-purchased product pairs'))
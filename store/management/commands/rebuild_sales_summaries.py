@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.sales import rebuild
+
+
+class Command(BaseCommand):
+    help = ('Recompute the daily and per-product sales summaries behind the staff sales report from the '
+            'completed orders. Checkout keeps them up to date; run this once for the existing history.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        days, products = rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Summarised sales for {days} days and {products} products'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.search import fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index from the product table.'
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError('Full-text search needs the SQLite database backend')
+        indexed = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} products'))
@@ -0,0 +1,161 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from store.catalog_cache import bump_catalog_version
+from store.models import Category, Customer, Order, OrderItem, Product, ProductType, ShippingAddress
+from store.recommendations import rebuild as rebuild_co_purchases
+from store.sales import rebuild as rebuild_sales
+from store.search import fts_available, rebuild_index
+
+ADJECTIVES = (
+    'classic premium compact portable durable lightweight original genuine wireless leather '
+    'cotton digital analog vintage modern deluxe rugged slim smart organic'
+).split()
+NOUNS = (
+    'laptop notebook sedan coupe headphones watch shirt shoes lotion novel charger battery '
+    'keyboard speaker camera backpack jacket lamp kettle blender'
+).split()
+STATES = ('Lagos', 'Abuja', 'Kano', 'Oyo', 'Rivers', 'Enugu', 'Kaduna', 'Ogun')
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with a generated catalog, customers and order history for load testing. '
+            'The same --seed always produces the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--types', type=int, default=20)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--max-lines', type=int, default=6, help='Most lines on one order.')
+        parser.add_argument('--days', type=int, default=365, help='Spread order dates over this many days.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        # Names carry the seed, so seeding twice with different seeds cannot clash on the unique names
+        self.tag = f's{options["seed"]}'
+        self.batch_size = options['batch_size']
+
+        with transaction.atomic():
+            types = self.create_types(options['types'])
+            categories = self.create_categories(options['categories'])
+            products = self.create_products(options['products'], types, categories)
+            customers = self.create_customers(options['customers'])
+            orders = self.create_orders(options['orders'], customers, products, options['max_lines'], options['days'])
+
+        # bulk_create skips the signals that keep these up to date
+        if fts_available():
+            rebuild_index()
+        bump_catalog_version()
+        rebuild_sales()
+        rebuild_co_purchases()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(types)} product types, {len(categories)} categories, {len(products)} products, '
+            f'{len(customers)} customers and {orders} orders'
+        ))
+
+    def bulk(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_types(self, count):
+        return self.bulk(ProductType, [ProductType(name=f'{noun.title()} {self.tag}-{i}')
+                                       for i, noun in enumerate(self.rng.choices(NOUNS, k=count))])
+
+    def create_categories(self, count):
+        return self.bulk(Category, [Category(name=f'{adjective.title()} {self.tag}-{i}')
+                                    for i, adjective in enumerate(self.rng.choices(ADJECTIVES, k=count))])
+
+    def create_products(self, count, types, categories):
+        rng = self.rng
+        products = []
+        for i in range(count):
+            price = Decimal(rng.randint(500, 500000)) / 100
+            digital = rng.random() < 0.1
+            words = rng.choices(ADJECTIVES, k=2) + [rng.choice(NOUNS)]
+            products.append(Product(
+                name=f'{" ".join(words).title()} {self.tag}-{i}',
+                product_type=rng.choice(types) if types else None,
+                category=rng.choice(categories) if categories else None,
+                description=' '.join(rng.choices(ADJECTIVES + NOUNS, k=rng.randint(10, 60))),
+                original_price=price + Decimal(rng.randint(0, 10000)) / 100,
+                price=price,
+                shipping=Decimal('0.00') if digital else Decimal(rng.randint(0, 2000)) / 100,
+                digital=digital,
+            ))
+        return self.bulk(Product, products)
+
+    def create_customers(self, count):
+        # One hash for every account: nobody logs in as these users, and hashing is slow
+        password = make_password(None)
+        users = self.bulk(User, [User(username=f'customer-{self.tag}-{i}', password=password) for i in range(count)])
+        return self.bulk(Customer, [
+            Customer(user=user, name=f'Customer {i}', phone=f'080{i:08d}', email=f'{user.username}@example.com')
+            for i, user in enumerate(users)
+        ])
+
+    def create_orders(self, count, customers, products, max_lines, days):
+        if not customers or not products:
+            return 0
+
+        rng = self.rng
+        now = timezone.now()
+        # The history is complete orders; about one customer in ten also has an open
+        # cart, since the views expect at most one per customer
+        buyers = [(rng.choice(customers), True) for _ in range(count)]
+        buyers += [(customer, False) for customer in rng.sample(customers, len(customers) // 10)]
+
+        for start in range(0, len(buyers), self.batch_size):
+            orders = []
+            order_lines = []
+            for i, (customer, complete) in enumerate(buyers[start:start + self.batch_size], start):
+                lines = rng.sample(products, min(len(products), rng.randint(1, max_lines)))
+                quantities = [rng.randint(1, 4) for _ in lines]
+                totals = [(p.price * q) + p.shipping for p, q in zip(lines, quantities)]
+                orders.append(Order(
+                    customer=customer,
+                    complete=complete,
+                    transaction_id=f'{self.tag}-{i}' if complete else None,
+                    cart_total=sum(totals),
+                    cart_items=sum(quantities),
+                    needs_shipping=any(not p.digital for p in lines),
+                ))
+                order_lines.append(list(zip(lines, quantities, totals)))
+
+            orders = self.bulk(Order, orders)
+            self.bulk(OrderItem, [
+                OrderItem(order=order, product=product, quantity=quantity,
+                          price=product.price, shipping=product.shipping, line_total=total)
+                for order, lines in zip(orders, order_lines)
+                for product, quantity, total in lines
+            ])
+            self.bulk(ShippingAddress, [
+                ShippingAddress(
+                    customer=order.customer, order=order, phone=order.customer.phone, email=order.customer.email,
+                    address=f'{rng.randint(1, 200)} Market Road', town='Ikeja', lga='Ikeja',
+                    state=rng.choice(STATES),
+                )
+                for order in orders if order.complete and order.needs_shipping
+            ])
+            self.spread_dates([order for order in orders if order.complete], now, days)
+        return len(buyers)
+
+    def spread_dates(self, orders, now, days):
+        # date_ordered is auto_now_add, so bulk_create stamps everything with now;
+        # move each order to a random day with one UPDATE per day
+        by_day = {}
+        for order in orders:
+            by_day.setdefault(self.rng.randrange(days or 1), []).append(order.pk)
+        for day, pks in by_day.items():
+            moment = now - timedelta(days=day, seconds=self.rng.randrange(86400))
+            Order.objects.filter(pk__in=pks).update(date_ordered=moment)
@@ -0,0 +1,39 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.notifications import process_due
+
+logger = logging.getLogger('store.notifications')
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued customer notifications. Runs until stopped unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process what is due now and exit.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait between polls.')
+        parser.add_argument('--batch-size', type=int, default=50, help='Recipients per message.')
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--backoff', type=float, default=60, help='Seconds before the first retry; doubles each time.')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sent, failed = process_due(
+                    batch_size=options['batch_size'],
+                    max_attempts=options['max_attempts'],
+                    backoff=options['backoff'],
+                )
+            except Exception:
+                if options['once']:
+                    raise
+                # A pass that fails outright (the database is away, say) must not stop the worker
+                logger.exception('Notification pass failed')
+            else:
+                if sent or failed:
+                    self.stdout.write(f'Sent {sent} notifications, {failed} failed')
+            if options['once']:
+                break
+            time.sleep(options['interval'])
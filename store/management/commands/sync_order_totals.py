@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from store.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = 'Backfill the stored order totals and line price snapshots, or check them with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Report drift without writing anything.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        verify = options['verify']
+        batch_size = options['batch_size']
+
+        lines = self.sync_lines(verify, batch_size)
+        orders = self.sync_orders(verify, batch_size)
+
+        if verify:
+            if lines or orders:
+                raise CommandError(f'{lines} order lines and {orders} orders are out of sync')
+            self.stdout.write(self.style.SUCCESS('All order totals are in sync'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Updated {lines} order lines and {orders} orders'))
+
+    def sync_lines(self, verify, batch_size):
+        drifted = 0
+        pending = []
+        items = OrderItem.objects.select_related('product').order_by('pk')
+
+        for item in items.iterator(chunk_size=batch_size):
+            changed = False
+            if item.price is None and item.product is not None:
+                # Nothing recorded the price at purchase time; today's price is the best we have
+                item.snapshot_prices(item.product)
+                changed = True
+
+            if item.price is None:
+                expected = 0
+            else:
+                expected = (item.price * (item.quantity or 0)) + item.shipping
+            if item.line_total != expected:
+                item.line_total = expected
+                changed = True
+
+            if changed:
+                drifted += 1
+                if not verify:
+                    pending.append(item)
+            if len(pending) >= batch_size:
+                self.flush(OrderItem, pending, ['price', 'shipping', 'line_total'])
+                pending = []
+
+        self.flush(OrderItem, pending, ['price', 'shipping', 'line_total'])
+        return drifted
+
+    def sync_orders(self, verify, batch_size):
+        drifted = 0
+        pending = []
+        orders = Order.objects.annotate(
+            line_total_sum=Sum('orderitem__line_total'),
+            quantity_sum=Sum('orderitem__quantity'),
+            physical_lines=Count('orderitem', filter=Q(orderitem__product__digital=False)),
+        ).order_by('pk')
+
+        for order in orders.iterator(chunk_size=batch_size):
+            cart_total = order.line_total_sum or 0
+            cart_items = order.quantity_sum or 0
+            needs_shipping = order.physical_lines > 0
+
+            if (order.cart_total, order.cart_items, order.needs_shipping) != (cart_total, cart_items, needs_shipping):
+                order.cart_total = cart_total
+                order.cart_items = cart_items
+                order.needs_shipping = needs_shipping
+                drifted += 1
+                if not verify:
+                    pending.append(order)
+            if len(pending) >= batch_size:
+                self.flush(Order, pending, ['cart_total', 'cart_items', 'needs_shipping'])
+                pending = []
+
+        self.flush(Order, pending, ['cart_total', 'cart_items', 'needs_shipping'])
+        return drifted
+
+    def flush(self, model, objects, fields):
+        if objects:
+            with transaction.atomic():
+                model.objects.bulk_update(objects, fields)
@@ -0,0 +1,216 @@
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# Uploaded media, served by serve_media() instead of the development-only
+# django.views.static.serve. URLs carry a hash of the file's content, as
+# ManifestStaticFilesStorage does for static files (photo.jpg is linked as
+# photo.3f2a9c1b7d4e.jpg), so a versioned URL never changes meaning and can be
+# cached for a year; anything else is revalidated with an ETag.
+FINGERPRINT_LENGTH = 12
+VERSIONED = re.compile(rf'^(?P<stem>.+)\.(?P<fingerprint>[0-9a-f]{{{FINGERPRINT_LENGTH}}})(?P<ext>\.[^./]+)?$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+
+# Variants written by the compress_media command, best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# path -> (size, mtime_ns, fingerprint); a file is only hashed again once it changes
+_fingerprints = {}
+
+
+def fingerprint(path, stat=None):
+    stat = stat or os.stat(path)
+    known = _fingerprints.get(path)
+    if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+        return known[2]
+    digest = hashlib.md5(usedforsecurity=False)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    value = digest.hexdigest()[:FINGERPRINT_LENGTH]
+    _fingerprints[path] = (stat.st_size, stat.st_mtime_ns, value)
+    return value
+
+
+def versioned_name(name, value):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{value}{ext}'
+
+
+class MediaStorage(FileSystemStorage):
+    """The default storage, linking files by their content-hashed names."""
+
+    def url(self, name):
+        try:
+            name = versioned_name(name, fingerprint(self.path(name)))
+        except (OSError, SuspiciousFileOperation):
+            # Missing files keep their plain URL, which 404s as before
+            pass
+        return super().url(name)
+
+
+def resolve(path):
+    # The file a request path names: its full path, its stored name and the fingerprint asked for, if any
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        if os.path.isfile(full_path):
+            return full_path, path, None
+        match = VERSIONED.match(path)
+        if match:
+            name = match['stem'] + (match['ext'] or '')
+            full_path = safe_join(settings.MEDIA_ROOT, name)
+            if os.path.isfile(full_path):
+                return full_path, name, match['fingerprint']
+    except SuspiciousFileOperation:
+        pass
+    raise Http404
+
+
+def same_mtime(variant, source):
+    # compress_media gives each copy its source's mtime, through a float, so allow for rounding
+    return abs(variant.st_mtime_ns - source.st_mtime_ns) < 1000
+
+
+def accepted_encodings(header):
+    # The codings an Accept-Encoding header allows: listed, or covered by "*", without q=0
+    qualities = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return {encoding for encoding, suffix in ENCODINGS
+            if qualities.get(encoding, qualities.get('*', 0)) > 0}
+
+
+def precompressed(request, full_path, stat):
+    # A compress_media variant the client accepts, if it is still current
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    for encoding, suffix in ENCODINGS:
+        if encoding not in accepted:
+            continue
+        try:
+            variant = os.stat(full_path + suffix)
+        except OSError:
+            continue
+        if same_mtime(variant, stat):
+            return encoding, full_path + suffix, variant
+    return None, full_path, stat
+
+
+def byte_range(request, etag, last_modified, size):
+    """The (start, end) of a single satisfiable Range, None for the whole file, or False if unsatisfiable.
+
+    A range that cannot be parsed, or ends before it starts, is ignored, as RFC 9110 asks.
+    """
+    header = request.headers.get('Range', '')
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+    if not match or match.groups() == ('', ''):
+        # No range, or several ranges: send the whole file, which the spec allows
+        return None
+
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+
+    first, last = match.groups()
+    if first and last and int(first) > int(last):
+        return None
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # bytes=-N is the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size:
+        return False
+    return start, end
+
+
+class RangedFile:
+    # At most ``length`` bytes of ``f`` from where it stands; FileResponse streams it
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+@require_safe
+def serve_media(request, path):
+    full_path, name, requested = resolve(path)
+    stat = os.stat(full_path)
+    current = fingerprint(full_path, stat)
+    if requested and requested != current:
+        # The file has been replaced since the page linked it
+        return HttpResponseRedirect(settings.MEDIA_URL + versioned_name(name, current))
+
+    # Ranges count bytes of the file itself, so they are never served from a compressed variant
+    encoding, send_path, send_stat = None, full_path, stat
+    if 'Range' not in request.headers:
+        encoding, send_path, send_stat = precompressed(request, full_path, stat)
+    etag = f'"{current}-{encoding}"' if encoding else f'"{current}"'
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag, last_modified)
+    if response is None:
+        ranged = byte_range(request, etag, last_modified, send_stat.st_size)
+        if ranged is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{send_stat.st_size}'
+            return response
+
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        filename = os.path.basename(full_path)
+        f = open(send_path, 'rb')
+        if ranged is None:
+            # A plain file object, which WSGI servers send with sendfile()
+            response = FileResponse(f, content_type=content_type, filename=filename)
+        else:
+            start, end = ranged
+            f.seek(start)
+            if end == send_stat.st_size - 1:
+                # Runs to the end of the file, so sendfile() can still send it from the seeked offset
+                response = FileResponse(f, content_type=content_type, filename=filename, status=206)
+            else:
+                response = FileResponse(RangedFile(f, end - start + 1), content_type=content_type,
+                                        filename=filename, status=206)
+                response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{send_stat.st_size}'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = IMMUTABLE if requested else REVALIDATE
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
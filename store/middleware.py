@@ -0,0 +1,158 @@
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger('store.timing')
+
+# The timings of the sampled request being handled, if any
+current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.rendering = 0
+        self.statements = Counter()
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self):
+        # The same parameterised statement run again, typically once per row of a loop
+        return sum(count - 1 for count in self.statements.values())
+
+
+def instrumented(timings=None):
+    # Wrap every connection of the calling thread. Other threads doing work for
+    # the request (see async_views) carry its context but not these wrappers,
+    # so they call this themselves
+    timings = timings or current.get()
+    stack = ExitStack()
+    if timings is not None:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timings.execute))
+    return stack
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = current.get()
+        if timings is None:
+            return super().render(context, request)
+        # Templates rendered from inside a template only count once
+        timings.rendering += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.rendering -= 1
+            if not timings.rendering:
+                timings.template += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, adding each render to the timed request's template time."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def sampled():
+    return random.random() < getattr(settings, 'SERVER_TIMING_SAMPLE_RATE', 0)
+
+
+class ServerTimingMiddleware:
+    """Time a sample of requests and report the split in a Server-Timing header and a log line.
+
+    SERVER_TIMING_SAMPLE_RATE is the fraction of requests timed; the rest pass
+    straight through. Template time is only measured with the
+    TimedDjangoTemplates backend.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not sampled():
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = current.set(timings)
+        started = time.perf_counter()
+        try:
+            with instrumented(timings):
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.report(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not sampled():
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = current.set(timings)
+        started = time.perf_counter()
+        # The request's thread-sensitive sync code, where its queries run, shares one thread
+        queries = await sync_to_async(instrumented)(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(queries.close)()
+            current.reset(token)
+        return self.report(request, response, timings, time.perf_counter() - started)
+
+    def report(self, request, response, timings, total):
+        duplicates = timings.duplicates()
+        view = max(total - timings.db - timings.template, 0)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries, {duplicates} duplicates"',
+            f'tpl;dur={timings.template * 1000:.1f}',
+            f'view;dur={view * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_ms': round(timings.db * 1000, 1),
+            'template_ms': round(timings.template * 1000, 1),
+            'view_ms': round(view * 1000, 1),
+            'queries': timings.queries,
+            'duplicate_queries': duplicates,
+        }
+        if duplicates:
+            sql, count = timings.statements.most_common(1)[0]
+            record['most_repeated'] = {'count': count, 'sql': sql[:200]}
+        logger.info(json.dumps(record))
+        return response
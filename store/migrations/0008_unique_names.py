@@ -0,0 +1,78 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:44
+
+from django.db import migrations, models
+import django.db.models.functions.text
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def duplicate_groups(model):
+    names = (
+        model.objects.annotate(name_lower=Lower('name'))
+        .values('name_lower').annotate(rows=Count('id')).filter(rows__gt=1, name_lower__isnull=False)
+        .values_list('name_lower', flat=True)
+    )
+    for name in names:
+        yield list(model.objects.annotate(name_lower=Lower('name')).filter(name_lower=name).order_by('id'))
+
+
+def merge_taxonomy(apps, model_name, field):
+    # Keep the oldest row of each duplicate group and move its products over
+    model = apps.get_model('store', model_name)
+    Product = apps.get_model('store', 'Product')
+    for keep, *duplicates in duplicate_groups(model):
+        ids = [duplicate.id for duplicate in duplicates]
+        moved = Product.objects.filter(**{f'{field}__in': ids}).update(**{field: keep})
+        model.objects.filter(id__in=ids).delete()
+        print(f'\n  {model_name} "{keep.name}": merged {len(ids)} duplicate(s) into id {keep.id}, moved {moved} product(s)')
+
+
+def resolve_duplicates(apps, schema_editor):
+    merge_taxonomy(apps, 'ProductType', 'product_type')
+    merge_taxonomy(apps, 'Category', 'category')
+
+    # Products carry order history, so duplicates are renamed rather than merged
+    Product = apps.get_model('store', 'Product')
+    renamed = []
+    for keep, *duplicates in duplicate_groups(Product):
+        for duplicate in duplicates:
+            duplicate.name = f'{duplicate.name} ({duplicate.id})'
+            duplicate.save(update_fields=['name'])
+        renamed += duplicates
+        print(f'\n  Product "{keep.name}": renamed {len(duplicates)} duplicate(s) to "<name> (<id>)"')
+    reindex(schema_editor, renamed)
+
+
+def reindex(schema_editor, products):
+    # Historical models send no post_save, so the search index (0006) is updated here
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for product in products:
+        schema_editor.execute('DELETE FROM store_product_fts WHERE rowid = %s', [product.id])
+        schema_editor.execute(
+            'INSERT INTO store_product_fts (rowid, name, description) VALUES (%s, %s, %s)',
+            [product.id, product.name or '', product.description or ''],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='unique_category_name', violation_error_message='A category with this name already exist'),
+        ),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='unique_product_name', violation_error_message='A product with this name already exist'),
+        ),
+        migrations.AddConstraint(
+            model_name='producttype',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='unique_product_type_name', violation_error_message='A product type with this name already exist'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['product_type', 'added_at'], name='store_produ_product_f835d2_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:26
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_products(apps, schema_editor):
+    # A product that has never been edited was last modified when it was added
+    Product = apps.get_model('store', 'Product')
+    Product.objects.update(updated_at=F('added_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_product_type_listing_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_products, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='producttype',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['product_type', 'updated_at'], name='store_produ_product_48d056_idx'),
+        ),
+    ]
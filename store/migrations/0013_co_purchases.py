@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_sales_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='co_purchases', to='store.product')),
+                ('related_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='purchased_with', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-score'], name='co_purchase_product_score')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='copurchase',
+            constraint=models.UniqueConstraint(fields=('product', 'related_product'), name='unique_co_purchase'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:00
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Fold each order's repeated lines for a product into its oldest one. The
+    # line totals are summed rather than recomputed, so order totals and sales
+    # history keep the amounts that were charged
+    OrderItem = apps.get_model('store', 'OrderItem')
+    groups = (
+        OrderItem.objects.filter(order__isnull=False, product__isnull=False).order_by()
+        .values('order', 'product').annotate(rows=Count('id')).filter(rows__gt=1)
+    )
+    merged = 0
+    for group in groups:
+        keep, *duplicates = OrderItem.objects.filter(order=group['order'], product=group['product']).order_by('id')
+        totals = OrderItem.objects.filter(pk__in=[keep.pk, *(line.pk for line in duplicates)]).aggregate(
+            quantity=Sum('quantity'), line_total=Sum('line_total'),
+        )
+        OrderItem.objects.filter(pk__in=[line.pk for line in duplicates]).delete()
+        keep.quantity = totals['quantity']
+        keep.line_total = totals['line_total']
+        keep.save(update_fields=['quantity', 'line_total'])
+        merged += len(duplicates)
+    if merged:
+        print(f'\n  OrderItem: merged {merged} duplicate line(s) into the oldest line of their order and product')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_co_purchases'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='orderitem',
+            name='store_order_order_i_ec571c_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_order_product'),
+        ),
+    ]
@@ -1,10 +1,13 @@
-from django.conf import settings
-from django.core.mail import send_mail
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Lower
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import catalog_cache, images
 
 
 # Create your models here.
@@ -14,13 +17,40 @@ class Customer(models.Model):
     phone = models.CharField(max_length=200, null=True)
     email = models.CharField(max_length=200, null=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['email'])]
+
     def __str__(self):
         return self.name
 
 
-class ProductType(models.Model):
+class ResponsiveImageMixin:
+    # Resized and WebP copies of ``image``, made on upload; the original until they exist (see images.py)
+    @property
+    def thumbnailURL(self):
+        return images.derivative_url(self.image.storage, self.image.name, images.WIDTHS[0])
+
+    @property
+    def imageSrcset(self):
+        return images.srcset(self.image.storage, self.image.name)
+
+    @property
+    def imageWebpSrcset(self):
+        return images.srcset(self.image.storage, self.image.name, webp=True)
+
+
+class ProductType(ResponsiveImageMixin, models.Model):
     name = models.CharField(max_length=200, null=True)
     image = models.ImageField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                Lower('name'), name='unique_product_type_name',
+                violation_error_message='A product type with this name already exist',
+            ),
+        ]
 
     @property
     def imageURL(self):
@@ -34,9 +64,18 @@ class ProductType(models.Model):
         return self.name
 
 
-class Category(models.Model):
+class Category(ResponsiveImageMixin, models.Model):
     name = models.CharField(max_length=200, null=True)
     image = models.ImageField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                Lower('name'), name='unique_category_name',
+                violation_error_message='A category with this name already exist',
+            ),
+        ]
 
     @property
     def imageURL(self):
@@ -50,7 +89,7 @@ class Category(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(ResponsiveImageMixin, models.Model):
     name = models.CharField(max_length=200, null=True)
     product_type = models.ForeignKey(ProductType, on_delete=models.SET_NULL, null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
@@ -61,6 +100,23 @@ class Product(models.Model):
     digital = models.BooleanField(default=False, null=True, blank=True)
     image = models.ImageField(blank=True, null=True)
     added_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                Lower('name'), name='unique_product_name',
+                violation_error_message='A product with this name already exist',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['price']),
+            models.Index(fields=['added_at']),
+            models.Index(fields=['product_type', 'added_at']),
+            models.Index(fields=['product_type', 'updated_at']),
+            # A type's listing by price, the categories page's price ordering within a type facet
+            models.Index(fields=['product_type', 'price']),
+        ]
 
     def __str__(self):
         return f'{self.name} selling for {self.price}'
@@ -74,6 +130,35 @@ class Product(models.Model):
         return url
 
 
+# The image receivers are connected to each ResponsiveImageMixin model in StoreConfig.ready()
+def remember_previous_image(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None:
+        return
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    instance._previous_image = sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+
+
+def refresh_image_derivatives(sender, instance, created, **kwargs):
+    if not created and not hasattr(instance, '_previous_image'):
+        # Saved with update_fields that leave the image alone
+        return
+    previous = instance.__dict__.pop('_previous_image', None)
+    if previous == instance.image.name:
+        return
+
+    storage = instance.image.storage
+    if previous:
+        images.delete_derivatives(storage, previous)
+    if instance.image:
+        images.generate_derivatives(storage, instance.image.name)
+
+
+def delete_image_derivatives(sender, instance, **kwargs):
+    if instance.image:
+        images.delete_derivatives(instance.image.storage, instance.image.name)
+
+
 @receiver(post_save, sender=Product)
 def send_product_added_email(sender, instance, created, **kwargs):
     if created:
@@ -82,18 +167,29 @@ def send_product_added_email(sender, instance, created, **kwargs):
                   f'Visit our website to explore the latest additions!\nThank you for choosing us.\n\n' \
                   f'You can check out the new product here: https://xystusshop.pythonanywhere.com'
 
-        # Fetch the email addresses of all customers
-        recipient_list = list(Customer.objects.values_list('email', flat=True))
+        # Queue the broadcast; the send_notifications worker delivers it
+        Notification.objects.create(subject=subject, message=message)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=ProductType)
+def bump_catalog_version(sender, using=None, **kwargs):
+    # After the commit: a bump inside the transaction would let another request
+    # cache the uncommitted rows' old values under the new version
+    transaction.on_commit(catalog_cache.bump_catalog_version, using=using)
 
-        try:
-            # Try sending the email
-            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list, fail_silently=False)
-        except Exception as e:
-            # Log or print the exception for debugging purposes
-            print(f"Email sending failed: {e}")
 
-    # Save the new product even if the email sending fails
-    # instance.save()
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, **kwargs):
+    from .search import index_product
+    index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product_for_search(sender, instance, **kwargs):
+    from .search import unindex_product
+    unindex_product(instance.pk)
 
 
 class Order(models.Model):
@@ -101,30 +197,51 @@ class Order(models.Model):
     date_ordered = models.DateTimeField(auto_now_add=True)
     complete = models.BooleanField(default=False, null=True, blank=True)
     transaction_id = models.CharField(max_length=100, null=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    # Running totals, kept in step with the order lines so reads cost no queries
+    cart_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    cart_items = models.IntegerField(default=0)
+    needs_shipping = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # The open cart lookup on every cart access
+            models.Index(fields=['customer', 'complete']),
+            models.Index(fields=['date_ordered']),
+        ]
 
     def __str__(self):
         return f'orderID = {str(self.id)}, Customer = {self.customer.name}'
 
     @property
     def shipping(self):
-        shipping = False
-        orderitems = self.orderitem_set.all()
-        for i in orderitems:
-            if i.product.digital == False:
-                shipping = True
-        return shipping
+        return self.needs_shipping
 
     @property
     def get_cart_total(self):
-        orderitem = self.orderitem_set.all()
-        total = sum([item.get_total for item in orderitem])
-        return total
+        return self.cart_total
 
     @property
     def get_cart_items(self):
-        orderitem = self.orderitem_set.all()
-        total = sum([item.quantity for item in orderitem])
-        return total
+        return self.cart_items
+
+    def recompute_totals(self):
+        # Rebuild the running totals from the lines in one UPDATE, inside the
+        # same transaction as the line writes, so concurrent edits cannot skew them
+        lines = OrderItem.objects.filter(order=OuterRef('pk')).values('order')
+        line_totals = lines.annotate(total=Sum('line_total')).values('total')
+        quantities = lines.annotate(total=Sum('quantity')).values('total')
+        Order.objects.filter(pk=self.pk).update(
+            cart_total=Coalesce(Subquery(line_totals), Value(0), output_field=models.DecimalField()),
+            cart_items=Coalesce(Subquery(quantities), Value(0)),
+            needs_shipping=Exists(lines.filter(product__digital=False)),
+        )
+
+    def reset_totals(self):
+        self.cart_total = 0
+        self.cart_items = 0
+        self.needs_shipping = False
+        Order.objects.filter(pk=self.pk).update(cart_total=0, cart_items=0, needs_shipping=False)
 
 
 class OrderItem(models.Model):
@@ -132,14 +249,81 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True)
     quantity = models.IntegerField(default=0, null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
+    # Prices as they were when the line was added
+    price = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    shipping = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    line_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        # One line per product on an order; cart edits add to it in place
+        constraints = [models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product')]
 
     def __str__(self):
         return self.product.name
 
     @property
     def get_total(self):
-        total = (self.product.price * self.quantity) + self.product.shipping
-        return total
+        return self.line_total
+
+    def snapshot_prices(self, product):
+        self.price = product.price
+        self.shipping = product.shipping
+
+
+class DailySales(models.Model):
+    """Completed orders summed by the day they were completed; see sales.py."""
+    date = models.DateField(primary_key=True)
+    orders = models.IntegerField(default=0)
+    items = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f'{self.date}: {self.orders} orders'
+
+
+class ProductSales(models.Model):
+    """Completed order lines summed per product; see sales.py."""
+    product = models.OneToOneField(Product, primary_key=True, on_delete=models.CASCADE, related_name='sales')
+    orders = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    last_sold_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['revenue'])]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.quantity} sold'
+
+
+class CategorySales(models.Model):
+    """Completed order lines summed per product category; see sales.py."""
+    category = models.OneToOneField(Category, primary_key=True, on_delete=models.CASCADE, related_name='sales')
+    orders = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f'{self.category_id}: {self.quantity} sold'
+
+
+class CoPurchase(models.Model):
+    """How many completed orders contained both products; see recommendations.py."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='co_purchases')
+    related_product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='purchased_with')
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related_product'], name='unique_co_purchase'),
+        ]
+        indexes = [
+            # A product's recommendations, best first, in one index range scan
+            models.Index(fields=['product', '-score'], name='co_purchase_product_score'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} with {self.related_product_id}: {self.score}'
 
 
 class ShippingAddress(models.Model):
@@ -155,3 +339,41 @@ class ShippingAddress(models.Model):
 
     def __str__(self):
         return f'{self.address} for {self.customer.name}'
+
+
+class Notification(models.Model):
+    """An email broadcast to every customer, waiting in the outbox for the worker."""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    subject = models.CharField(max_length=200)
+    message = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    recipients_resolved = models.BooleanField(default=False)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f'{self.subject} ({self.status})'
+
+
+class NotificationRecipient(models.Model):
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='recipients')
+    email = models.CharField(max_length=200)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'email'], name='unique_notification_recipient'),
+        ]
+
+    def __str__(self):
+        return self.email
@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models.functions import Lower, Trim
+from django.utils import timezone
+
+from .models import Customer, Notification, NotificationRecipient
+
+# How long a worker may hold a notification before another worker can claim it
+LEASE = timedelta(minutes=10)
+
+
+def resolve_recipients(notification):
+    # Snapshot the customer list once, so retries only go to addresses not yet sent to
+    emails = (
+        Customer.objects.exclude(email__isnull=True)
+        .annotate(address=Lower(Trim('email')))
+        .exclude(address='')
+        .values_list('address', flat=True)
+        .distinct()
+    )
+    NotificationRecipient.objects.bulk_create(
+        [NotificationRecipient(notification=notification, email=email) for email in emails.iterator()],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    notification.recipients_resolved = True
+    notification.save(update_fields=['recipients_resolved'])
+
+
+def claim(notification, now):
+    # Only one worker wins the conditional update for a given due time
+    claimed = Notification.objects.filter(
+        pk=notification.pk, status=Notification.PENDING, next_attempt_at=notification.next_attempt_at,
+    ).update(next_attempt_at=now + LEASE)
+    return claimed == 1
+
+
+def deliver(notification, connection, batch_size):
+    """Send a notification to its unsent recipients, one Bcc'd message per chunk."""
+    if not notification.recipients_resolved:
+        resolve_recipients(notification)
+
+    pending = notification.recipients.filter(sent_at__isnull=True).order_by('pk')
+    while True:
+        chunk = list(pending.values_list('pk', 'email')[:batch_size])
+        if not chunk:
+            break
+        message = EmailMessage(
+            notification.subject,
+            notification.message,
+            settings.DEFAULT_FROM_EMAIL,
+            to=[settings.DEFAULT_FROM_EMAIL],
+            bcc=[email for pk, email in chunk],
+            connection=connection,
+        )
+        message.send()
+        NotificationRecipient.objects.filter(pk__in=[pk for pk, email in chunk]).update(sent_at=timezone.now())
+
+
+def process_due(batch_size=50, max_attempts=5, backoff=60, limit=None):
+    """Deliver every pending notification that is due. Returns (sent, failed) counts."""
+    now = timezone.now()
+    due = Notification.objects.filter(status=Notification.PENDING, next_attempt_at__lte=now).order_by('pk')
+    if limit:
+        due = due[:limit]
+
+    sent = failed = 0
+    connection = None
+    try:
+        for notification in due:
+            if not claim(notification, now):
+                continue
+            try:
+                if connection is None:
+                    # One SMTP connection is shared by every chunk of every notification in
+                    # this pass; failing to open it is a failed attempt at this notification
+                    connection = get_connection()
+                    connection.open()
+                deliver(notification, connection, batch_size)
+            except Exception as e:
+                notification.attempts += 1
+                notification.last_error = str(e)
+                if notification.attempts >= max_attempts:
+                    notification.status = Notification.FAILED
+                else:
+                    delay = backoff * (2 ** (notification.attempts - 1))
+                    notification.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+                notification.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+                failed += 1
+                # The connection may be broken; start a fresh one for the next notification
+                if connection is not None:
+                    connection.close()
+                connection = None
+            else:
+                notification.status = Notification.SENT
+                notification.sent_at = timezone.now()
+                notification.save(update_fields=['status', 'sent_at'])
+                sent += 1
+    finally:
+        if connection is not None:
+            connection.close()
+    return sent, failed
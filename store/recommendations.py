@@ -0,0 +1,95 @@
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+
+from .models import CoPurchase, Order, OrderItem, Product
+from .utils import shuffled
+
+# "Frequently bought together" for the product detail page. CoPurchase holds,
+# for each product, the products that were on the same completed orders and
+# in how many of them. processOrder adds each order it completes with a fixed
+# number of queries; rebuild() recomputes the table from the order history
+# and keeps only each product's best RELATED_PER_PRODUCT, which keeps it small.
+RECOMMENDATIONS = 12
+RELATED_PER_PRODUCT = 24
+# Orders with more different products than this say little about what goes
+# together, and would add a pair for every two of them
+MAX_ORDER_PRODUCTS = 25
+
+
+def record_co_purchases(order):
+    """Count a just-completed order's products as bought together, inside the transaction that completes it."""
+    products = set(OrderItem.objects.filter(order=order, product__isnull=False).values_list('product', flat=True))
+    if not 2 <= len(products) <= MAX_ORDER_PRODUCTS:
+        return
+    CoPurchase.objects.bulk_create([
+        CoPurchase(product_id=product, related_product_id=related)
+        for product in products for related in products if product != related
+    ], ignore_conflicts=True)
+    # Every pair among the order's products is bought together once more; the sum happens in the UPDATE
+    CoPurchase.objects.filter(product__in=products, related_product__in=products).update(score=F('score') + 1)
+
+
+def rebuild(batch_size=1000):
+    orders = (
+        Order.objects.filter(complete=True, cart_items__gt=0)
+        .annotate(products=Count('orderitem__product', distinct=True))
+        .filter(products__gte=2, products__lte=MAX_ORDER_PRODUCTS).values('pk')
+    )
+    pairs = (
+        OrderItem.objects.filter(order__in=orders, product__isnull=False)
+        .annotate(related=F('order__orderitem__product'))
+        .filter(related__isnull=False).exclude(related=F('product'))
+        .values('product', 'related').annotate(score=Count('order', distinct=True))
+        .order_by('product', '-score', 'related')
+    )
+
+    # Hundreds of thousands of three-number rows: a plain INSERT run for each
+    # skips building a model instance per row, which bulk_create spent most of its time on
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(CoPurchase._meta.get_field(name).column) for name in ('product', 'related_product', 'score'))
+    sql = f'INSERT INTO {quote(CoPurchase._meta.db_table)} ({columns}) VALUES (%s, %s, %s)'
+
+    created = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        CoPurchase.objects.all().delete()
+        batch = []
+        product, kept = None, 0
+        for row in pairs.iterator(chunk_size=batch_size):
+            if row['product'] != product:
+                product, kept = row['product'], 0
+            if kept == RELATED_PER_PRODUCT:
+                continue
+            kept += 1
+            batch.append((row['product'], row['related'], row['score']))
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                created += len(batch)
+                batch = []
+        cursor.executemany(sql, batch)
+        created += len(batch)
+    return created
+
+
+def recommended_products(product_id, seed, limit=RECOMMENDATIONS):
+    """The products most often bought with this one, topped up with shuffled products of its type."""
+    products = list(
+        Product.objects.filter(purchased_with__product=product_id).order_by('-purchased_with__score', 'pk')[:limit]
+    )
+    if len(products) < limit:
+        # Looks up the product's type itself, so callers need not load the product first
+        same_type = Product.objects.filter(pk=product_id).values('product_type')
+        products += shuffled(
+            Product.objects.filter(product_type__in=same_type).exclude(pk__in=[product_id, *(p.pk for p in products)]),
+            seed,
+        )[:limit - len(products)]
+    return products
+
+
+def co_purchase_freshness():
+    # Annotations for a Product query that change whenever its recommendations
+    # might: a score moves, a pair is added or removed, or a recommended product is edited
+    pairs = CoPurchase.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    return {
+        'co_purchase_score': Subquery(pairs.annotate(total=Sum('score')).values('total')),
+        'co_purchase_updated_at': Subquery(pairs.annotate(latest=Max('related_product__updated_at')).values('latest')),
+    }
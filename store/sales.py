@@ -0,0 +1,118 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import CategorySales, DailySales, Order, OrderItem, ProductSales
+
+# Sales summaries for the staff report. processOrder adds each order it
+# completes to its day's DailySales row and to the ProductSales and
+# CategorySales rows of what is on it, with a fixed number of queries however
+# many lines it has, so the report reads a few small tables instead of the
+# order history. rebuild() recomputes them all from the history (the
+# rebuild_sales_summaries command). Order lines do not record the product's
+# category, so a sale counts under the category its product had when it was
+# completed, and after a rebuild under the one it has now.
+REPORT_DAYS = (7, 30, 90, 365)
+DEFAULT_DAYS = 30
+TOP_PRODUCTS = 10
+
+
+def add(model, totals, **values):
+    # Add {pk: {field: amount}} to the summary rows, creating missing ones first.
+    # The sums happen in the UPDATE, so concurrent checkouts cannot lose a sale
+    model.objects.bulk_create([model(pk=pk) for pk in totals], ignore_conflicts=True)
+    model.objects.bulk_update([
+        model(pk=pk, **{name: F(name) + amount for name, amount in amounts.items()}, **values)
+        for pk, amounts in totals.items()
+    ], [*next(iter(totals.values())), *values])
+
+
+def record_sale(order):
+    """Add a just-completed order to the summaries, inside the transaction that completes it."""
+    if not order.cart_items:
+        return
+    sold_at = order.completed_at or order.date_ordered
+    add(DailySales, {timezone.localdate(sold_at): {
+        'orders': 1, 'items': order.cart_items, 'revenue': order.cart_total,
+    }})
+
+    lines = (
+        OrderItem.objects.filter(order=order, product__isnull=False).order_by()
+        .values('product', 'product__category').annotate(quantity=Sum('quantity'), revenue=Sum('line_total'))
+    )
+    products = {}
+    categories = {}
+    for line in lines:
+        quantity = line['quantity'] or 0
+        products[line['product']] = {'orders': 1, 'quantity': quantity, 'revenue': line['revenue']}
+        if line['product__category'] is not None:
+            category = categories.setdefault(line['product__category'], {'orders': 1, 'quantity': 0, 'revenue': 0})
+            category['quantity'] += quantity
+            category['revenue'] += line['revenue']
+    if products:
+        add(ProductSales, products, last_sold_at=sold_at)
+    if categories:
+        add(CategorySales, categories)
+
+
+def rebuild(batch_size=1000):
+    # Orders completed before completed_at existed count on the day they were placed.
+    # Categories are the products' current ones
+    completed = Order.objects.filter(complete=True, cart_items__gt=0)
+    lines = OrderItem.objects.filter(order__complete=True, order__cart_items__gt=0, product__isnull=False).order_by()
+    days = (
+        completed.annotate(day=TruncDate(Coalesce('completed_at', 'date_ordered'))).order_by().values('day')
+        .annotate(orders=Count('id'), items=Sum('cart_items'), revenue=Sum('cart_total'))
+    )
+    products = lines.values('product').annotate(
+        orders=Count('order', distinct=True), quantity=Sum('quantity'), revenue=Sum('line_total'),
+        last_sold_at=Max(Coalesce('order__completed_at', 'order__date_ordered')),
+    )
+    categories = lines.filter(product__category__isnull=False).values('product__category').annotate(
+        orders=Count('order', distinct=True), quantity=Sum('quantity'), revenue=Sum('line_total'),
+    )
+
+    with transaction.atomic():
+        for model in (DailySales, ProductSales, CategorySales):
+            model.objects.all().delete()
+        daily = DailySales.objects.bulk_create([
+            DailySales(date=row['day'], orders=row['orders'], items=row['items'], revenue=row['revenue'])
+            for row in days.iterator()
+        ], batch_size=batch_size)
+        per_product = ProductSales.objects.bulk_create([
+            ProductSales(product_id=row['product'], orders=row['orders'], quantity=row['quantity'] or 0,
+                         revenue=row['revenue'], last_sold_at=row['last_sold_at'])
+            for row in products.iterator()
+        ], batch_size=batch_size)
+        CategorySales.objects.bulk_create([
+            CategorySales(category_id=row['product__category'], orders=row['orders'],
+                          quantity=row['quantity'] or 0, revenue=row['revenue'])
+            for row in categories.iterator()
+        ], batch_size=batch_size)
+    return len(daily), len(per_product)
+
+
+def sales_report(days):
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    found = {row.date: row for row in DailySales.objects.filter(date__gte=start)}
+    # Days without sales have no row; show them as zeros, newest first
+    daily = [found.get(start + timedelta(days=i)) or DailySales(date=start + timedelta(days=i))
+             for i in reversed(range(days))]
+
+    peak = max((row.revenue for row in daily), default=0)
+    for row in daily:
+        row.share = round(row.revenue / peak * 100) if peak else 0
+
+    return {
+        'daily': daily,
+        'orders': sum(row.orders for row in daily),
+        'items': sum(row.items for row in daily),
+        'revenue': sum((row.revenue for row in daily), 0),
+        'top_products': ProductSales.objects.select_related('product').order_by('-revenue')[:TOP_PRODUCTS],
+        # By category as of the sale or the last rebuild, whichever is later
+        'categories': CategorySales.objects.select_related('category').order_by('-revenue'),
+    }
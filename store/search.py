@@ -0,0 +1,135 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Product
+
+# Full-text index over product names and descriptions, kept in an SQLite FTS5
+# table whose rowid is the product id. Other databases fall back to icontains.
+FTS_TABLE = 'store_product_fts'
+
+# bm25 column weights: a hit in the name counts far more than one in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# highlight()/snippet() wrap matches in these control characters so the text
+# can be HTML-escaped before they are swapped for <mark> tags
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def build_match(query):
+    # Every word must match, as a prefix; quoting each term keeps FTS5 syntax
+    # characters in user input from being interpreted
+    terms = re.findall(r'\w+', query or '')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def highlight(text):
+    html = escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+    return mark_safe(html)
+
+
+def index_product(product):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [product.pk, product.name or '', product.description or ''],
+        )
+
+
+def index_products(products):
+    # index_product for many rows at once, for imports that bypass the post_save signal
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [[product.pk] for product in products])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [[product.pk, product.name or '', product.description or ''] for product in products],
+        )
+
+
+def unindex_product(product_id):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def rebuild_index():
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+            f'SELECT id, COALESCE(name, \'\'), COALESCE(description, \'\') FROM {Product._meta.db_table}'
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+class ProductSearch:
+    """Ranked full-text matches, sliced lazily so a Paginator only fetches one page.
+
+    Each product returned carries ``name_highlight`` and ``snippet`` with the
+    matched words wrapped in ``<mark>``.
+    """
+
+    def __init__(self, query):
+        self.match = build_match(query)
+
+    def count(self):
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [self.match])
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        if not self.match or key.stop is None or key.stop <= start:
+            return []
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, highlight({FTS_TABLE}, 0, %s, %s), '
+                f'snippet({FTS_TABLE}, 1, %s, %s, %s, 16) '
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, %s, %s) LIMIT %s OFFSET %s',
+                [MARK_START, MARK_END, MARK_START, MARK_END, '…', self.match,
+                 NAME_WEIGHT, DESCRIPTION_WEIGHT, key.stop - start, start],
+            )
+            rows = cursor.fetchall()
+
+        products = Product.objects.in_bulk([row[0] for row in rows])
+        results = []
+        for product_id, name, snippet in rows:
+            product = products.get(product_id)
+            if product is None:
+                continue
+            product.name_highlight = highlight(name)
+            product.snippet = highlight(snippet)
+            results.append(product)
+        return results
+
+
+def search_products(query):
+    if fts_available():
+        return ProductSearch(query)
+    return Product.objects.filter(Q(name__icontains=query) | Q(description__icontains=query)).order_by('name', 'id')
@@ -1,5 +1,7 @@
 from django import template
 
+from store import catalog_cache
+
 register = template.Library()
 
 
@@ -7,3 +9,35 @@ register = template.Library()
 def format_price(value):
     formatted_value = "{:,.2f}".format(value)
     return formatted_value
+
+
+@register.simple_tag
+def srcset(obj, webp=False):
+    # Responsive candidates for an object's image, e.g. {% srcset product %} or {% srcset product webp=True %}
+    if webp:
+        return obj.imageWebpSrcset
+    return obj.imageSrcset
+
+
+class CatalogCacheNode(template.Node):
+    def __init__(self, nodelist, name, parts):
+        self.nodelist = nodelist
+        self.name = name
+        self.parts = parts
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        parts = [part.resolve(context) for part in self.parts]
+        return catalog_cache.cached(f'fragment:{name}', lambda: self.nodelist.render(context), *parts)
+
+
+@register.tag
+def catalogcache(parser, token):
+    # {% catalogcache 'name' [key parts...] %}...{% endcatalogcache %} caches the rendered
+    # block until the catalog changes. Keep per-user output (cart counts, csrf) out of it.
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name")
+    nodelist = parser.parse(('endcatalogcache',))
+    parser.delete_first_token()
+    return CatalogCacheNode(nodelist, parser.compile_filter(bits[1]), [parser.compile_filter(bit) for bit in bits[2:]])
@@ -1,3 +1,1769 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection, connections, IntegrityError, OperationalError, transaction
+from django.db.models.signals import pre_save
+from django.http import HttpResponse
+from django.template import Context, Template, engines
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from PIL import Image
+
+from . import catalog_cache, images
+from .context_processors import cart as cart_context
+from .conditional import product_detail_freshness
+from .facets import facet_counts
+from .filters import OrderFilter, ProductFilter, category_choices, product_type_choices
+from .keyset import LATEST_FIRST, PRODUCT_ORDERINGS, keyset_paginate
+from .forms import ProductTypeForm, UpdateProductForm
+from .media import serve_media
+from .middleware import RequestTimings, ServerTimingMiddleware, current
+from .models import *
+from .notifications import process_due
+from .search import ProductSearch
+from .utils import applyCartOperations, cookieCart, parseCart, shuffled
+
+
+class GuestCheckoutMixin:
+    def guest_checkout(self, cart, total, shipping=True, client=None):
+        # Check out {product: quantity} from the cart cookie as a guest
+        client = client or self.client
+        client.cookies['cart'] = json.dumps({str(p.id): {'quantity': q} for p, q in cart.items()})
+        data = {'form': {'name': 'Guest', 'phone': '123', 'email': 'guest@example.com', 'total': total}}
+        if shipping:
+            data['shipping'] = {
+                'phone': '123', 'email': 'guest@example.com', 'address': '1 Road',
+                'town': 'Town', 'lga': 'LGA', 'state': 'State',
+            }
+        return client.post('/process_order/', json.dumps(data), content_type='application/json')
+
+
+class TempMediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class CookieCartTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.product_type = ProductType.objects.create(name='Laptops')
+        self.category = Category.objects.create(name='Electronics')
+
+    def make_products(self, count, digital=False):
+        return [
+            Product.objects.create(
+                name=f'Product {i}',
+                product_type=self.product_type,
+                category=self.category,
+                original_price=Decimal('20.00'),
+                price=Decimal('10.00'),
+                shipping=Decimal('2.50'),
+                digital=digital,
+            )
+            for i in range(count)
+        ]
+
+    def request_with_cart(self, cart):
+        request = self.factory.get('/')
+        request.COOKIES['cart'] = json.dumps(cart)
+        return request
+
+    def test_prices_cart_lines(self):
+        first, second = self.make_products(2)
+        request = self.request_with_cart({
+            str(first.id): {'quantity': 2},
+            str(second.id): {'quantity': 1},
+        })
+
+        data = cookieCart(request)
+
+        self.assertEqual(data['cartItems'], 3)
+        self.assertEqual(data['order']['get_cart_items'], 3)
+        self.assertEqual(data['order']['get_cart_total'], Decimal('35.00'))
+        self.assertTrue(data['order']['shipping'])
+        self.assertEqual([item['product']['id'] for item in data['items']], [first.id, second.id])
+        self.assertEqual(data['items'][0]['get_total'], Decimal('22.50'))
+        self.assertEqual(data['items'][0]['product']['type'], 'Laptops')
+        self.assertEqual(data['items'][0]['product']['category'], 'Electronics')
+
+    def test_digital_only_cart_needs_no_shipping(self):
+        product, = self.make_products(1, digital=True)
+        data = cookieCart(self.request_with_cart({str(product.id): {'quantity': 1}}))
+        self.assertFalse(data['order']['shipping'])
+
+    def test_skips_missing_and_invalid_lines(self):
+        product, = self.make_products(1)
+        request = self.request_with_cart({
+            str(product.id): {'quantity': 1},
+            '999999': {'quantity': 4},
+            'abc': {'quantity': 1},
+            str(product.id + 1000): {'qty': 1},
+            str(product.id + 2000): {'quantity': 0},
+        })
+
+        data = cookieCart(request)
+
+        self.assertEqual(data['cartItems'], 1)
+        self.assertEqual(len(data['items']), 1)
+
+    def test_malformed_cookie_is_an_empty_cart(self):
+        self.assertEqual(parseCart('not json'), {})
+        self.assertEqual(parseCart('[1, 2]'), {})
+        self.assertEqual(parseCart(None), {})
+
+    def test_query_count_is_constant(self):
+        products = self.make_products(30)
+        for size in (1, 5, 30):
+            cart = {str(p.id): {'quantity': 1} for p in products[:size]}
+            with self.assertNumQueries(1):
+                data = cookieCart(self.request_with_cart(cart))
+            self.assertEqual(data['cartItems'], size)
+
+    def test_empty_cart_issues_no_queries(self):
+        with self.assertNumQueries(0):
+            data = cookieCart(self.factory.get('/'))
+        self.assertEqual(data['items'], [])
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.customer = Customer.objects.create(user=self.user, name='Buyer', email='buyer@example.com')
+        self.client.force_login(self.user)
+        self.book = Product.objects.create(
+            name='Book', original_price=Decimal('15.00'), price=Decimal('10.00'),
+            shipping=Decimal('1.00'), digital=False,
+        )
+        self.ebook = Product.objects.create(
+            name='Ebook', original_price=Decimal('8.00'), price=Decimal('5.00'),
+            shipping=Decimal('0.00'), digital=True,
+        )
+
+    def update(self, product, action):
+        return self.client.post(
+            '/update_item/', json.dumps({'productId': product.id, 'action': action}),
+            content_type='application/json',
+        )
+
+    def open_order(self):
+        return Order.objects.get(customer=self.customer, complete=False)
+
+    def test_update_item_keeps_running_totals(self):
+        self.update(self.book, 'add')
+        self.update(self.book, 'add')
+        self.update(self.ebook, 'add')
+
+        order = self.open_order()
+        self.assertEqual(order.get_cart_total, Decimal('26.00'))
+        self.assertEqual(order.get_cart_items, 3)
+        self.assertTrue(order.shipping)
+
+        self.update(self.book, 'remove')
+        self.update(self.book, 'remove')
+
+        order = self.open_order()
+        self.assertEqual(order.get_cart_total, Decimal('5.00'))
+        self.assertEqual(order.get_cart_items, 1)
+        self.assertFalse(order.shipping)
+        self.assertFalse(order.orderitem_set.filter(product=self.book).exists())
+
+    def test_reading_totals_costs_no_queries(self):
+        self.update(self.book, 'add')
+        order = self.open_order()
+        with self.assertNumQueries(0):
+            order.get_cart_total, order.get_cart_items, order.shipping
+
+    def test_line_totals_ignore_later_price_changes(self):
+        self.update(self.book, 'add')
+        self.book.price = Decimal('99.00')
+        self.book.save()
+
+        order = self.open_order()
+        self.assertEqual(order.get_cart_total, Decimal('11.00'))
+        self.assertEqual(order.orderitem_set.get().get_total, Decimal('11.00'))
+
+    def test_clear_cart_resets_totals(self):
+        self.update(self.book, 'add')
+        self.client.post('/clear_cart/', '{}', content_type='application/json')
+
+        order = self.open_order()
+        self.assertEqual(order.get_cart_total, 0)
+        self.assertEqual(order.get_cart_items, 0)
+        self.assertFalse(order.shipping)
+
+    def test_sync_command_backfills_and_verifies(self):
+        order = Order.objects.create(customer=self.customer)
+        OrderItem.objects.create(order=order, product=self.book, quantity=2)
+
+        with self.assertRaises(CommandError):
+            call_command('sync_order_totals', '--verify', stdout=StringIO())
+
+        call_command('sync_order_totals', stdout=StringIO())
+        call_command('sync_order_totals', '--verify', stdout=StringIO())
+
+        order.refresh_from_db()
+        self.assertEqual(order.cart_total, Decimal('21.00'))
+        self.assertEqual(order.cart_items, 2)
+        self.assertTrue(order.needs_shipping)
+
+
+class ShuffledListingTests(TestCase):
+    def setUp(self):
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', original_price=Decimal('2.00'), price=Decimal('1.00'))
+            for i in range(40)
+        ])
+
+    def page_ids(self, page):
+        response = self.client.get('/', {'page': page})
+        return [product.id for product in response.context['product_page'].object_list]
+
+    def test_pages_are_stable_and_disjoint_within_a_session(self):
+        first = self.page_ids(1)
+        pages = first + self.page_ids(2) + self.page_ids(3)
+
+        self.assertEqual(len(first), 16)
+        self.assertEqual(sorted(pages), sorted(Product.objects.values_list('id', flat=True)))
+        self.assertEqual(self.page_ids(1), first)
+
+    def test_seed_changes_the_order(self):
+        ids = list(Product.objects.values_list('id', flat=True))
+        first = list(shuffled(Product.objects.all(), 12345).values_list('id', flat=True))
+        second = list(shuffled(Product.objects.all(), 67890).values_list('id', flat=True))
+
+        self.assertEqual(sorted(first), sorted(ids))
+        self.assertNotEqual(first, ids)
+        self.assertNotEqual(first, second)
+
+    def test_shop_is_paginated(self):
+        response = self.client.get('/shop/', {'page': 2})
+        self.assertEqual(len(response.context['product_page'].object_list), 16)
+
+
+class ProductSearchTests(TestCase):
+    def make_product(self, name, description=''):
+        return Product.objects.create(
+            name=name, description=description, original_price=Decimal('2.00'), price=Decimal('1.00'),
+        )
+
+    def test_name_matches_rank_above_description_matches(self):
+        described = self.make_product('Travel bag', 'Fits a laptop up to 15 inches')
+        named = self.make_product('HP laptop', 'A dependable machine')
+
+        results = ProductSearch('laptop')
+
+        self.assertEqual(results.count(), 2)
+        self.assertEqual([p.id for p in results[:10]], [named.id, described.id])
+
+    def test_results_are_highlighted_and_escaped(self):
+        self.make_product('<b>Leather</b> watch', 'Genuine leather strap')
+
+        product, = ProductSearch('leath')[:1]
+
+        self.assertEqual(product.name_highlight, '&lt;b&gt;<mark>Leather</mark>&lt;/b&gt; watch')
+        self.assertIn('<mark>leather</mark>', product.snippet)
+
+    def test_index_follows_saves_and_deletes(self):
+        product = self.make_product('Red shirt')
+        self.assertEqual(ProductSearch('shirt').count(), 1)
+
+        product.name = 'Blue blouse'
+        product.save()
+        self.assertEqual(ProductSearch('shirt').count(), 0)
+        self.assertEqual(ProductSearch('blouse').count(), 1)
+
+        product.delete()
+        self.assertEqual(ProductSearch('blouse').count(), 0)
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.make_product('Nivea lotion')
+        self.assertEqual(ProductSearch('"nivea" (lot').count(), 1)
+        self.assertEqual(ProductSearch('*"').count(), 0)
+
+    def test_rebuild_command(self):
+        Product.objects.bulk_create([
+            Product(name=f'Book {i}', original_price=Decimal('2.00'), price=Decimal('1.00')) for i in range(3)
+        ])
+        self.assertEqual(ProductSearch('book').count(), 0)
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(ProductSearch('book').count(), 3)
+
+    def test_shop_paginates_search_results(self):
+        for i in range(20):
+            self.make_product(f'Shoe {i}')
+
+        response = self.client.get('/shop/', {'query': 'shoe', 'results_page': 2})
+
+        results = response.context['results']
+        self.assertEqual(results.paginator.count, 20)
+        self.assertEqual(len(results.object_list), 4)
+
+
+class StaffOrdersTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        staff_customer = Customer.objects.create(user=self.staff, name='Staff')
+        # The staff member's own open cart is an incomplete order too
+        Order.objects.create(customer=staff_customer, complete=False)
+        self.client.force_login(self.staff)
+        self.products = [
+            Product.objects.create(name=f'Watch {i}', original_price=Decimal('2.00'), price=Decimal('1.00'))
+            for i in range(5)
+        ]
+
+    def make_orders(self, count, lines, complete=True):
+        customer = Customer.objects.create(name='Buyer')
+        for _ in range(count):
+            order = Order.objects.create(customer=customer, complete=complete)
+            for product in self.products[:lines]:
+                OrderItem.objects.create(order=order, product=product, quantity=1)
+            ShippingAddress.objects.create(customer=customer, order=order, address='1 Main St')
+
+    def count_queries(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/order/', params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_query_count_does_not_grow_with_orders_or_lines(self):
+        self.make_orders(2, 1)
+        small, _ = self.count_queries()
+
+        self.make_orders(20, 5)
+        large, response = self.count_queries()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.context['orders'].object_list), 12)
+
+    def test_filters_by_completion_and_date(self):
+        self.make_orders(3, 1, complete=True)
+        self.make_orders(2, 1, complete=False)
+
+        _, response = self.count_queries({'complete': 'true'})
+        self.assertEqual(response.context['orders'].paginator.count, 3)
+
+        _, response = self.count_queries({'complete': 'false'})
+        self.assertEqual(response.context['orders'].paginator.count, 3)
+
+        _, response = self.count_queries({'date_ordered_after': '2000-01-01', 'date_ordered_before': '2000-12-31'})
+        self.assertEqual(response.context['orders'].paginator.count, 0)
+
+
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        for email in ['a@example.com', 'A@example.com ', 'b@example.com', 'c@example.com', '', None]:
+            Customer.objects.create(name='Customer', email=email)
+
+    def add_product(self):
+        return Product.objects.create(name='Headphones', original_price=Decimal('2.00'), price=Decimal('1.00'))
+
+    def test_product_save_only_queues_the_broadcast(self):
+        self.add_product()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Notification.objects.get().status, Notification.PENDING)
+
+    def test_worker_sends_deduplicated_chunks(self):
+        self.add_product()
+
+        call_command('send_notifications', '--once', '--batch-size', '2', stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 2)
+        sent_to = sorted(email for message in mail.outbox for email in message.bcc)
+        self.assertEqual(sent_to, ['a@example.com', 'b@example.com', 'c@example.com'])
+        self.assertEqual(Notification.objects.get().status, Notification.SENT)
+
+    def test_failed_chunk_is_retried_with_backoff(self):
+        notification = Notification.objects.create(subject='Hi', message='Hello')
+        real_send = EmailMessage.send
+        calls = []
+
+        def flaky_send(message, *args, **kwargs):
+            calls.append(message)
+            if len(calls) == 2:
+                raise OSError('connection reset')
+            return real_send(message, *args, **kwargs)
+
+        with mock.patch.object(EmailMessage, 'send', flaky_send):
+            self.assertEqual(process_due(batch_size=2, backoff=30), (0, 1))
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.attempts, 1)
+        self.assertEqual(notification.last_error, 'connection reset')
+        self.assertGreater(notification.next_attempt_at, timezone.now())
+        self.assertEqual(process_due(), (0, 0))
+
+        Notification.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(process_due(batch_size=2), (1, 0))
+
+        # The first chunk went out before the failure and is not sent again
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[1].bcc, ['c@example.com'])
+
+    def test_connection_failure_counts_as_an_attempt(self):
+        notification = Notification.objects.create(subject='Hi', message='Hello')
+        with mock.patch('store.notifications.get_connection') as get_connection:
+            get_connection.return_value.open.side_effect = OSError('smtp down')
+            self.assertEqual(process_due(backoff=30), (0, 1))
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.attempts, 1)
+        self.assertEqual(notification.last_error, 'smtp down')
+        self.assertGreater(notification.next_attempt_at, timezone.now())
+        self.assertEqual(notification.status, Notification.PENDING)
+
+    def test_worker_survives_a_failed_pass(self):
+        passes = [RuntimeError('database is locked'), (1, 0), KeyboardInterrupt]
+
+        def process_due(**kwargs):
+            result = passes.pop(0)
+            if isinstance(result, tuple):
+                return result
+            raise result
+
+        out = StringIO()
+        with mock.patch('store.management.commands.send_notifications.process_due', process_due), \
+                mock.patch('time.sleep'), self.assertLogs('store.notifications', 'ERROR'):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('send_notifications', stdout=out)
+        self.assertIn('Sent 1 notifications', out.getvalue())
+
+    def test_gives_up_after_max_attempts(self):
+        notification = Notification.objects.create(subject='Hi', message='Hello', attempts=2)
+        with mock.patch.object(EmailMessage, 'send', side_effect=OSError('down')):
+            process_due(max_attempts=3)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, Notification.FAILED)
+
+
+class UniqueNameTests(TestCase):
+    def test_duplicate_names_are_rejected_case_insensitively(self):
+        ProductType.objects.create(name='Laptops')
+        form = ProductTypeForm({'name': 'LAPTOPS'})
+
+        with self.assertNumQueries(1):
+            self.assertFalse(form.is_valid())
+        self.assertIn('A product type with this name already exist', form.non_field_errors())
+
+    def test_updating_a_product_keeps_its_own_name(self):
+        product = Product.objects.create(name='Watch', original_price=Decimal('2.00'), price=Decimal('1.00'))
+        form = UpdateProductForm({
+            'name': 'watch', 'original_price': '3.00', 'price': '2.00', 'shipping': '0',
+        }, instance=product)
+        self.assertTrue(form.is_valid(), form.errors)
+
+    def test_database_rejects_a_racing_duplicate(self):
+        Category.objects.create(name='Shoes')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Category.objects.create(name='shoes')
+
+
+class ImageDerivativeTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        images._checked.clear()
+
+    def upload(self, name, size=(800, 600), fmt='JPEG'):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, fmt)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def make_product(self, image):
+        return Product.objects.create(name='Car', original_price=Decimal('2.00'), price=Decimal('1.00'), image=image)
+
+    def files(self):
+        return sorted(os.listdir(self.media_root))
+
+    def test_receivers_are_only_connected_to_image_models(self):
+        for model in (Product, ProductType, Category):
+            self.assertTrue(pre_save.has_listeners(model))
+        for model in (Order, OrderItem, Notification, DailySales):
+            self.assertFalse(pre_save.has_listeners(model))
+
+    def test_upload_creates_resized_and_webp_copies(self):
+        product = self.make_product(self.upload('car.jpg'))
+
+        self.assertEqual(self.files(), [
+            'car.jpg', 'car_jpg_w120.jpg', 'car_jpg_w120.webp', 'car_jpg_w320.jpg', 'car_jpg_w320.webp',
+            'car_jpg_w640.jpg', 'car_jpg_w640.webp',
+        ])
+        with Image.open(os.path.join(self.media_root, 'car_jpg_w320.webp')) as image:
+            self.assertEqual(image.size, (320, 240))
+        # URLs carry a hash of the file's content (see media.py)
+        self.assertRegex(product.thumbnailURL, r'^/documents/car_jpg_w120\.[0-9a-f]{12}\.jpg$')
+        self.assertRegex(
+            product.imageWebpSrcset,
+            r'^/documents/car_jpg_w120\.\w{12}\.webp 120w, /documents/car_jpg_w320\.\w{12}\.webp 320w, '
+            r'/documents/car_jpg_w640\.\w{12}\.webp 640w$',
+        )
+
+    def test_replacing_and_deleting_clean_up_copies(self):
+        product = self.make_product(self.upload('car.jpg'))
+        product.image = self.upload('van.png', fmt='PNG')
+        product.save()
+
+        self.assertNotIn('car_jpg_w120.jpg', self.files())
+        self.assertIn('van_png_w120.png', self.files())
+
+        product.delete()
+        self.assertEqual([name for name in self.files() if '_w' in name], [])
+
+    def test_originals_sharing_a_stem_keep_their_own_copies(self):
+        jpeg = self.make_product(self.upload('car.jpg'))
+        png = Product.objects.create(name='Van', original_price=Decimal('2.00'), price=Decimal('1.00'),
+                                     image=self.upload('car.png', fmt='PNG'))
+        self.assertIn('car_png_w120.png', self.files())
+
+        png.delete()
+        self.assertIn('car_jpg_w120.webp', self.files())
+        self.assertRegex(jpeg.thumbnailURL, r'^/documents/car_jpg_w120\.\w{12}\.jpg$')
+
+    def test_pages_use_the_original_until_copies_are_made(self):
+        product = self.make_product(self.upload('car.jpg'))
+        for name in self.files():
+            if '_w' in name:
+                os.remove(os.path.join(self.media_root, name))
+        images._checked.clear()
+
+        html = Template('{% load custom_filters %}{% srcset product %}').render(Context({'product': product}))
+        self.assertEqual(html, '')
+        self.assertRegex(product.thumbnailURL, r'^/documents/car\.\w{12}\.jpg$')
+        self.assertEqual(self.files(), ['car.jpg'])
+
+        call_command('generate_image_derivatives', stdout=StringIO())
+        html = Template('{% load custom_filters %}{% srcset product %}').render(Context({'product': product}))
+        self.assertRegex(html, r'/documents/car_jpg_w640\.\w{12}\.jpg 640w')
+
+    def test_checked_originals_are_bounded(self):
+        with mock.patch.object(images, 'CHECKED_LIMIT', 2):
+            for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+                images.remember(name)
+        self.assertEqual(list(images._checked), ['b.jpg', 'c.jpg'])
+
+    def test_unreadable_image_falls_back_to_original(self):
+        product = self.make_product(SimpleUploadedFile('broken.jpg', b'not an image'))
+        self.assertEqual(product.imageSrcset, '')
+        self.assertRegex(product.thumbnailURL, r'^/documents/broken\.\w{12}\.jpg$')
+
+
+class MediaServingTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        self.write('clip.bin', self.content)
+
+    def write(self, name, content):
+        with open(os.path.join(self.media_root, name), 'wb') as f:
+            f.write(content)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_versioned_urls_are_immutable(self):
+        url = default_storage.url('clip.bin')
+        self.assertRegex(url, r'^/documents/clip\.[0-9a-f]{12}\.bin$')
+
+        response = self.client.get(url)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        # A real file, which WSGI servers hand to sendfile(); the test client wraps it, so ask the view directly
+        direct = serve_media(RequestFactory().get(url), url.removeprefix('/documents/'))
+        self.assertTrue(hasattr(direct.file_to_stream, 'fileno'))
+        direct.close()
+
+        plain = self.client.get('/documents/clip.bin')
+        self.assertEqual(plain['Cache-Control'], 'public, no-cache')
+        self.assertEqual(plain['ETag'], response['ETag'])
+        self.assertEqual(self.client.get('/documents/clip.bin', HTTP_IF_NONE_MATCH=plain['ETag']).status_code, 304)
+
+    def test_replaced_files_redirect_to_their_new_url(self):
+        old_url = default_storage.url('clip.bin')
+        self.write('clip.bin', b'new content')
+        response = self.client.get(old_url)
+        self.assertRedirects(response, default_storage.url('clip.bin'), fetch_redirect_response=False)
+        self.assertNotEqual(old_url, default_storage.url('clip.bin'))
+
+    def test_ranges(self):
+        response = self.client.get('/documents/clip.bin', HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/1024')
+        self.assertEqual(response['Content-Length'], '4')
+        self.assertEqual(self.body(response), self.content[2:6])
+
+        response = self.client.get('/documents/clip.bin', HTTP_RANGE='bytes=1000-')
+        self.assertEqual(self.body(response), self.content[1000:])
+        self.assertEqual(response['Content-Length'], '24')
+        self.assertEqual(self.body(self.client.get('/documents/clip.bin', HTTP_RANGE='bytes=-10')), self.content[-10:])
+
+        response = self.client.get('/documents/clip.bin', HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+        # An invalid range is ignored rather than refused
+        response = self.client.get('/documents/clip.bin', HTTP_RANGE='bytes=9-3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+        # A range of an older version is not applied to the current one
+        response = self.client.get('/documents/clip.bin', HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_precompressed_variants(self):
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg">' + b'<rect width="1" height="1"/>' * 200 + b'</svg>'
+        self.write('logo.svg', svg)
+        call_command('compress_media', stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'logo.svg.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'clip.bin.gz.gz')))
+
+        response = self.client.get('/documents/logo.svg', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(self.body(response)), svg)
+
+        self.assertNotIn('Content-Encoding', self.client.get('/documents/logo.svg'))
+        for header in ('gzip;q=0, identity', 'deflate', 'x-gzip', '*;q=0'):
+            response = self.client.get('/documents/logo.svg', HTTP_ACCEPT_ENCODING=header)
+            self.assertNotIn('Content-Encoding', response, header)
+        response = self.client.get('/documents/logo.svg', HTTP_ACCEPT_ENCODING='br;q=0, *;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        # A copy older than its source is ignored
+        self.write('logo.svg', svg + b' ')
+        response = self.client.get('/documents/logo.svg', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_paths_outside_media_root_are_not_served(self):
+        for path in ('/documents/../manage.py', '/documents/%2e%2e/manage.py', '/documents/missing.jpg'):
+            with self.subTest(path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.product = Product.objects.create(name='Cheap watch', original_price=Decimal('2.00'), price=Decimal('1.00'))
+
+    def test_rails_are_served_from_cache(self):
+        with CaptureQueriesContext(connection) as cold:
+            self.client.get('/')
+        with CaptureQueriesContext(connection) as warm:
+            response = self.client.get('/')
+
+        self.assertContains(response, 'Cheap watch')
+        self.assertLess(len(warm), len(cold))
+        self.assertFalse(any('ORDER BY "store_product"."price"' in query['sql'] for query in warm))
+
+        stats = catalog_cache.cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 3))
+
+    def test_catalog_changes_invalidate_fragments(self):
+        self.client.get('/')
+        self.product.name = 'Bargain watch'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+        self.assertContains(self.client.get('/'), 'Bargain watch')
+
+        version = catalog_cache.catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Watches')
+        self.assertNotEqual(catalog_cache.catalog_version(), version)
+
+    def test_version_changes_when_the_change_commits(self):
+        version = catalog_cache.catalog_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.save()
+        # Until then, other requests still read the old rows
+        self.assertEqual(catalog_cache.catalog_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(catalog_cache.catalog_version(), version)
+
+    def test_other_models_leave_the_version_alone(self):
+        version = catalog_cache.catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(subject='Hi', message='Hello')
+        self.assertEqual(catalog_cache.catalog_version(), version)
+        # With no receivers for them, deleting rows needs no SELECT first
+        with self.assertNumQueries(1):
+            Notification.objects.filter(recipients_resolved=True).delete()
+
+    def test_cart_count_is_not_cached(self):
+        self.client.get('/')
+        self.client.cookies['cart'] = json.dumps({str(self.product.id): {'quantity': 3}})
+        response = self.client.get('/')
+        self.assertContains(response, '<p id="cart-total" class="notification-count">3</p>', html=True)
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_guest_pages_without_catalog_data_issue_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/contact/')
+        self.assertContains(response, '<p id="cart-total" class="notification-count">0</p>', html=True)
+
+    def test_guest_count_is_one_query_and_skips_missing_products(self):
+        watch = Product.objects.create(name='Watch', original_price=Decimal('2.00'), price=Decimal('1.00'))
+        cart = {str(watch.id): {'quantity': 2}, str(watch.id + 1): {'quantity': 5}}
+        self.client.cookies['cart'] = json.dumps(cart)
+        with self.assertNumQueries(1):
+            response = self.client.get('/contact/')
+        self.assertContains(response, '<p id="cart-total" class="notification-count">2</p>', html=True)
+
+        request = self.factory.get('/')
+        request.COOKIES['cart'] = json.dumps(cart)
+        self.assertEqual(cookieCart(request)['cartItems'], 2)
+
+    def test_customer_count_is_one_lazy_query_without_writes(self):
+        user = User.objects.create_user('buyer', password='secret')
+        customer = Customer.objects.create(user=user, name='Buyer')
+        Order.objects.create(customer=customer, complete=False, cart_items=4)
+        Order.objects.create(customer=customer, complete=True, cart_items=7)
+
+        request = self.factory.get('/')
+        request.user = user
+        with self.assertNumQueries(0):
+            context = cart_context(request)
+        with self.assertNumQueries(1):
+            self.assertEqual(str(context['cartItems']), '4')
+            self.assertEqual(str(cart_context(request)['cartItems']), '4')
+
+    def test_customer_without_a_cart_gets_zero_and_no_order(self):
+        user = User.objects.create_user('browser', password='secret')
+        Customer.objects.create(user=user, name='Browser')
+        self.client.force_login(user)
+
+        response = self.client.get('/contact/')
+
+        self.assertContains(response, '<p id="cart-total" class="notification-count">0</p>', html=True)
+        self.assertFalse(Order.objects.exists())
+
+
+class BatchCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.customer = Customer.objects.create(user=self.user, name='Buyer')
+        self.client.force_login(self.user)
+        self.shirt = Product.objects.create(
+            name='Shirt', original_price=Decimal('9.00'), price=Decimal('5.00'), shipping=Decimal('1.00'),
+        )
+        self.ebook = Product.objects.create(
+            name='Ebook', original_price=Decimal('9.00'), price=Decimal('3.00'), digital=True,
+        )
+
+    def post(self, operations):
+        return self.client.post('/update_cart/', json.dumps({'operations': operations}), content_type='application/json')
+
+    def test_applies_a_batch_and_returns_the_summary(self):
+        response = self.post([
+            {'productId': self.shirt.id, 'quantity': 10},
+            {'productId': self.ebook.id, 'action': 'add'},
+            {'productId': self.shirt.id, 'action': 'remove'},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        summary = response.json()
+        self.assertEqual(summary['cartItems'], 10)
+        self.assertEqual(summary['cartTotal'], '49.00')
+        self.assertTrue(summary['shipping'])
+        self.assertEqual(
+            sorted((item['productId'], item['quantity']) for item in summary['items']),
+            [(self.shirt.id, 9), (self.ebook.id, 1)],
+        )
+
+    def test_setting_zero_removes_the_line(self):
+        self.post([{'productId': self.shirt.id, 'quantity': 2}])
+        summary = self.post([{'productId': self.shirt.id, 'quantity': 0}]).json()
+
+        self.assertEqual(summary['items'], [])
+        self.assertEqual(summary['cartTotal'], '0.00')
+        self.assertFalse(summary['shipping'])
+
+    def test_unknown_product_rejects_the_whole_batch(self):
+        response = self.post([
+            {'productId': self.shirt.id, 'action': 'add'},
+            {'productId': 999999, 'action': 'add'},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_invalid_operations_are_rejected(self):
+        for operations in ([], [{'productId': self.shirt.id, 'action': 'double'}], [{'productId': 'x', 'quantity': 1}]):
+            self.assertEqual(self.post(operations).status_code, 400)
+
+    def test_guests_are_refused(self):
+        self.client.logout()
+        self.assertEqual(self.post([{'productId': self.shirt.id, 'action': 'add'}]).status_code, 403)
+
+
+class CheckoutTests(GuestCheckoutMixin, TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(
+                name=f'Book {i}', original_price=Decimal('15.00'), price=Decimal('10.00'),
+                shipping=Decimal('1.00'), digital=False,
+            )
+            for i in range(6)
+        ]
+
+    def checkout(self, products, total, shipping=True):
+        return self.guest_checkout({p: 2 for p in products}, total, shipping)
+
+    def test_guest_checkout_writes_lines_in_bulk(self):
+        # The first checkout also creates the customer; compare two returning ones
+        self.checkout(self.products[:1], '21.00')
+        # Two lines rather than one, since a single product has no co-purchases to record
+        with CaptureQueriesContext(connection) as small:
+            self.checkout(self.products[:2], '42.00')
+        with CaptureQueriesContext(connection) as large:
+            response = self.checkout(self.products, '126.00')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(large), len(small))
+        order = Order.objects.latest('id')
+        self.assertTrue(order.complete)
+        self.assertEqual(order.orderitem_set.count(), 6)
+        self.assertEqual(Order.objects.filter(complete=True).count(), 3)
+        self.assertEqual(order.get_cart_total, Decimal('126.00'))
+        self.assertEqual(Customer.objects.filter(email='guest@example.com').count(), 1)
+
+    def test_failed_checkout_leaves_nothing_behind(self):
+        response = self.checkout(self.products, '126.00', shipping=False)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(Customer.objects.exists())
+
+
+class SeedAndBenchmarkTests(TestCase):
+    def seed(self, **options):
+        options = {'products': 30, 'types': 3, 'categories': 4, 'customers': 10, 'orders': 40, **options}
+        call_command('seed_catalog', stdout=StringIO(), **options)
+
+    def test_seed_is_deterministic(self):
+        self.seed()
+        first = list(Product.objects.order_by('name').values_list('name', 'price', 'category__name'))
+        self.assertEqual(len(first), 30)
+        self.assertEqual(Customer.objects.count(), 10)
+        self.assertEqual(Order.objects.filter(complete=True).count(), 40)
+        # The views expect at most one open cart per customer
+        self.assertEqual(Order.objects.filter(complete=False).count(), 1)
+
+        for model in (Order, Product, ProductType, Category):
+            model.objects.all().delete()
+        self.seed(customers=0)
+        self.assertEqual(list(Product.objects.order_by('name').values_list('name', 'price', 'category__name')), first)
+
+    def test_benchmark_covers_every_url(self):
+        self.seed()
+        out = StringIO()
+        call_command('benchmark_views', repeat=1, warmup=0, output='-', stdout=out)
+        report = json.loads(out.getvalue())
+
+        from .management.commands.benchmark_views import url_names
+        from .urls import urlpatterns
+        self.assertEqual(set(report['views']), set(url_names(urlpatterns)))
+        self.assertIn('api_products', report['views'])
+        self.assertEqual(report['views']['shop']['status'], 200)
+        self.assertGreater(report['views']['shop']['queries'], 0)
+        # The benchmark's own writes are rolled back
+        self.assertFalse(User.objects.filter(username='benchmark-staff').exists())
+
+
+class ServerTimingTests(TestCase):
+    def view(self, request):
+        for product_id in (1, 2, 3):
+            Product.objects.filter(pk=product_id).exists()
+        return HttpResponse(engines['django'].from_string('{{ value }}').render({'value': 'x'}))
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_sampled_requests_report_queries_and_duplicates(self):
+        middleware = ServerTimingMiddleware(self.view)
+        with self.assertLogs('store.timing', 'INFO') as logs:
+            response = middleware(RequestFactory().get('/'))
+
+        header = response['Server-Timing']
+        self.assertIn('desc="3 queries, 2 duplicates"', header)
+        for metric in ('db;dur=', 'tpl;dur=', 'view;dur=', 'total;dur='):
+            self.assertIn(metric, header)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['queries'], 3)
+        self.assertEqual(record['duplicate_queries'], 2)
+        self.assertEqual(record['most_repeated']['count'], 3)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_async_requests_are_timed(self):
+        async def view(request):
+            return await sync_to_async(self.view)(request)
+
+        middleware = ServerTimingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.assertLogs('store.timing', 'INFO'):
+            response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertIn('desc="3 queries, 2 duplicates"', response['Server-Timing'])
+
+    def test_renders_are_timed_by_the_template_backend(self):
+        timings = RequestTimings()
+        token = current.set(timings)
+        try:
+            engines['django'].from_string('{{ value }}').render({'value': 'x'})
+        finally:
+            current.reset(token)
+        self.assertGreater(timings.template, 0)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_pass_through(self):
+        response = ServerTimingMiddleware(self.view)(RequestFactory().get('/'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_header_on_real_views(self):
+        with self.assertLogs('store.timing', 'INFO'):
+            response = self.client.get('/contact/')
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+
+
+@override_settings(ROOT_URLCONF='eCommerce.asgi_urls')
+class AsyncCatalogTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.shoes = ProductType.objects.create(name='Shoes')
+        self.boot = Product.objects.create(
+            name='Leather boot', product_type=self.shoes, original_price=Decimal('30.00'), price=Decimal('20.00'),
+        )
+        self.sandal = Product.objects.create(
+            name='Beach sandal', product_type=self.shoes, original_price=Decimal('12.00'), price=Decimal('8.00'),
+        )
+
+    def test_catalog_pages_resolve_to_async_views(self):
+        from . import async_views, views
+        self.assertIs(resolve('/', urlconf='eCommerce.asgi_urls').func, async_views.index)
+        self.assertIs(resolve('/', urlconf='eCommerce.urls').func, views.index)
+        self.assertIs(resolve('/cart/', urlconf='eCommerce.asgi_urls').func, views.cart)
+
+    async def test_pages_render(self):
+        client = AsyncClient()
+        for url in ('/', '/shop/', '/categories/', f'/product_type/{self.shoes.pk}/'):
+            response = await client.get(url)
+            self.assertContains(response, 'Leather boot')
+
+        response = await client.get(f'/product_detail/{self.boot.pk}/')
+        self.assertContains(response, 'Beach sandal')
+
+        response = await client.get('/shop/', {'query': 'sandal'})
+        self.assertContains(response, '<mark>sandal</mark>', html=False)
+
+        response = await client.get('/product_type/999/')
+        self.assertEqual(response.status_code, 404)
+
+        response = await client.get(f'/product_type/{self.shoes.pk}/')
+        response = await client.get(f'/product_type/{self.shoes.pk}/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    async def test_pool_thread_queries_are_timed(self):
+        with self.assertLogs('store.timing', 'INFO') as logs:
+            await AsyncClient().get(f'/product_type/{self.shoes.pk}/')
+        self.assertGreaterEqual(json.loads(logs.records[0].getMessage())['queries'], 2)
+
+
+class DatabaseRoutingTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def pragma(self, alias, name):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned(self):
+        for alias in ('default', 'replica'):
+            self.assertEqual(self.pragma(alias, 'journal_mode'), 'wal')
+            self.assertEqual(self.pragma(alias, 'synchronous'), 1)
+            self.assertEqual(self.pragma(alias, 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma('default', 'query_only'), 0)
+        self.assertEqual(self.pragma('replica', 'query_only'), 1)
+
+    def test_catalog_reads_use_the_read_connection(self):
+        product = Product.objects.create(name='Kettle', original_price=Decimal('9.00'), price=Decimal('5.00'))
+        self.assertEqual(product._state.db, 'default')
+        self.assertEqual(Product.objects.get(pk=product.pk)._state.db, 'replica')
+        self.assertEqual(Order.objects.all().db, 'default')
+
+        # Inside a transaction reads stay on the writer and see its uncommitted rows
+        with transaction.atomic():
+            Product.objects.create(name='Toaster', original_price=Decimal('9.00'), price=Decimal('5.00'))
+            self.assertEqual(Product.objects.all().db, 'default')
+            self.assertEqual(Product.objects.count(), 2)
+            # Meanwhile the read connection is neither blocked nor shown the open write
+            self.assertEqual(Product.objects.using('replica').count(), 1)
+
+    def test_read_connection_refuses_writes(self):
+        with self.assertRaises(OperationalError):
+            with connections['replica'].cursor() as cursor:
+                cursor.execute("DELETE FROM store_product")
+
+
+class QueryPlanTests(TestCase):
+    """The hot queries the views build must be answered from an index, not a full table scan."""
+
+    def querysets(self):
+        customer = Customer.objects.create(name='Buyer', email='buyer@example.com')
+        order = Order.objects.create(customer=customer)
+        product = Product.objects.create(name='Shirt', original_price=Decimal('9.00'), price=Decimal('5.00'))
+        orders = Order.objects.order_by('-date_ordered', '-id')
+        return {
+            'index cheapest': Product.objects.order_by('price')[:10],
+            'index latest': Product.objects.all().order_by('-added_at')[:12],
+            'open cart': Order.objects.filter(customer=customer, complete=False),
+            'guest customer': Customer.objects.filter(email='buyer@example.com'),
+            'cart line': OrderItem.objects.filter(order=order, product=product),
+            'staff orders': orders[:12],
+            'staff orders by date': OrderFilter(
+                {'date_ordered_after': '2024-01-01', 'date_ordered_before': '2024-02-01'}, orders,
+            ).qs[:12],
+        }
+
+    def view_queries(self):
+        # The SQL of the helpers the views call, run as the views run them
+        shoes = ProductType.objects.create(name='Shoes')
+        Product.objects.bulk_create([
+            Product(name=f'Shoe {i}', product_type=shoes, original_price=Decimal('90.00'), price=Decimal(i + 1))
+            for i in range(60)
+        ])
+        factory = RequestFactory()
+        filtered = {'product_type': str(shoes.pk), 'price_min': '10', 'price_max': '50'}
+        product = Product.objects.filter(product_type=shoes).first()
+        detail_request = factory.get('/')
+        detail_request.session = {}
+        # The filter's choice lists come from the catalog cache, warm on a running site
+        product_type_choices()
+        category_choices()
+
+        def listing(params, queryset, ordering, per_page):
+            # A first page, then the one after it, found by seeking past its last row
+            page = keyset_paginate(factory.get('/', params), queryset, ordering, per_page)
+            list(page)
+            list(keyset_paginate(factory.get('/', {**params, 'cursor': page.next_cursor()}), queryset, ordering, per_page))
+
+        # Each build with the tables it may scan: the quick rail's subquery reads
+        # the first few products in primary key order and stops at its LIMIT
+        builds = {
+            'product type listing': (lambda: listing({}, Product.objects.filter(product_type=shoes), LATEST_FIRST, 24), ()),
+            'categories listing': (lambda: listing(
+                filtered, ProductFilter(filtered, Product.objects.all()).qs, PRODUCT_ORDERINGS['price'], 25,
+            ), ()),
+            'facet counts': (lambda: facet_counts(factory.get('/', filtered).GET), ()),
+            'product detail freshness': (lambda: product_detail_freshness(detail_request, product.pk), ('U0',)),
+        }
+        queries = {}
+        for label, (build, bounded) in builds.items():
+            with CaptureQueriesContext(connection) as captured:
+                build()
+            queries[label] = ([query['sql'] for query in captured if query['sql'].startswith('SELECT')], bounded)
+        return queries
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndexes(self, plan, ordered, bounded=()):
+        # "SCAN table" without "USING ... INDEX" reads every row
+        scans = set(re.findall(r'(?m)SCAN (\w+)$', plan))
+        self.assertFalse(scans - set(bounded))
+        if ordered:
+            self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('plans are checked with SQLite EXPLAIN QUERY PLAN')
+
+        for label, queryset in self.querysets().items():
+            plan = queryset.explain()
+            with self.subTest(label, plan=plan):
+                self.assertUsesIndexes(plan, bool(queryset.query.order_by))
+
+    def test_view_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('plans are checked with SQLite EXPLAIN QUERY PLAN')
+
+        for label, (statements, bounded) in self.view_queries().items():
+            self.assertTrue(statements, label)
+            for sql in statements:
+                plan = self.plan(sql)
+                with self.subTest(label, sql=sql, plan=plan):
+                    self.assertUsesIndexes(plan, ' ORDER BY ' in sql, bounded)
+
+
+class FacetedBrowseTests(TestCase):
+    def setUp(self):
+        catalog_cache.bump_catalog_version()
+        self.shoes = ProductType.objects.create(name='Shoes')
+        self.bags = ProductType.objects.create(name='Bags')
+        self.men = Category.objects.create(name='Men')
+        self.women = Category.objects.create(name='Women')
+        for i in range(30):
+            Product.objects.create(
+                name=f'Item {i}', product_type=self.shoes if i < 20 else self.bags,
+                category=self.men if i % 2 else self.women,
+                original_price=Decimal('90000.00'), price=Decimal(1000 * (i + 1)),
+            )
+
+    def facets(self, response):
+        return {facet['title']: {entry['label']: entry for entry in facet['entries']}
+                for facet in response.context['facets']}
+
+    def test_counts_ignore_their_own_selection(self):
+        response = self.client.get('/categories/', {'product_type': self.shoes.pk})
+        facets = self.facets(response)
+
+        self.assertEqual(facets['Product type']['Shoes']['count'], 20)
+        self.assertEqual(facets['Product type']['Bags']['count'], 10)
+        self.assertTrue(facets['Product type']['Shoes']['selected'])
+        self.assertEqual(facets['Category']['Men']['count'], 10)
+        self.assertEqual(facets['Price']['₦0 – ₦5,000']['count'], 4)
+        self.assertEqual(facets['Price']['₦5,000 – ₦20,000']['count'], 15)
+        self.assertEqual(facets['Price']['₦20,000 – ₦100,000']['count'], 1)
+
+        # A price bucket link gives exactly the products it counted
+        response = self.client.get(f"/categories/?{facets['Price']['₦5,000 – ₦20,000']['query']}")
+        self.assertEqual(response.context['product_page'].paginator.count, 15)
+
+        # Following a link applies that value on top of the current selection
+        query = facets['Category']['Men']['query']
+        self.assertIn(f'product_type={self.shoes.pk}', query)
+        response = self.client.get(f'/categories/?{query}')
+        self.assertEqual(response.context['product_page'].paginator.count, 10)
+
+    def test_results_are_paginated(self):
+        response = self.client.get('/categories/')
+        self.assertEqual(len(response.context['product_page'].object_list), 24)
+        response = self.client.get('/categories/', {'page': 2})
+        self.assertEqual(len(response.context['product_page'].object_list), 6)
+
+    def test_queries_are_bounded_and_choices_cached(self):
+        self.client.get('/categories/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/categories/', {'category': self.men.pk})
+        self.assertFalse([q for q in queries if 'FROM "store_producttype"' in q['sql']])
+        self.assertFalse([q for q in queries if 'FROM "store_category"' in q['sql']])
+
+        for i in range(30, 60):
+            Product.objects.create(name=f'Item {i}', category=self.men, original_price=10, price=10)
+        self.client.get('/categories/')
+        with CaptureQueriesContext(connection) as more:
+            self.client.get('/categories/', {'category': self.men.pk})
+        self.assertEqual(len(more), len(queries))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        catalog_cache.bump_catalog_version()
+        self.shoes = ProductType.objects.create(name='Shoes')
+        Product.objects.bulk_create([
+            Product(name=f'Item {i}', product_type=self.shoes, original_price=Decimal('90.00'), price=Decimal(i % 7))
+            for i in range(60)
+        ])
+        # Ties on the leading key must still give every product exactly one place
+        Product.objects.filter(id__lte=Product.objects.order_by('id')[29].id).update(added_at=timezone.now())
+        self.factory = RequestFactory()
+
+    def page(self, ordering, cursor='', per_page=25):
+        params = {'cursor': cursor} if cursor else {}
+        return keyset_paginate(self.factory.get('/', params), Product.objects.all(), ordering, per_page)
+
+    def walk(self, ordering):
+        pages = [self.page(ordering)]
+        while pages[-1].has_next:
+            pages.append(self.page(ordering, pages[-1].next_cursor()))
+        return pages
+
+    def test_pages_cover_the_ordering_both_ways(self):
+        for ordering in (('-added_at', '-id'), ('price', 'id')):
+            expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+            pages = self.walk(ordering)
+            self.assertEqual([len(page) for page in pages], [25, 25, 10])
+            self.assertEqual([product.id for page in pages for product in page], expected)
+            self.assertFalse(pages[0].has_previous)
+
+            back = self.page(ordering, pages[-1].previous_cursor())
+            self.assertEqual([product.id for product in back], [product.id for product in pages[1]])
+            first = self.page(ordering, back.previous_cursor())
+            self.assertEqual([product.id for product in first], expected[:25])
+            self.assertFalse(first.has_previous)
+            self.assertTrue(first.has_next)
+
+    def test_bad_cursors_give_the_first_page(self):
+        latest = ('-added_at', '-id')
+        first = [product.id for product in self.page(latest)]
+        cursor = self.page(latest).next_cursor()
+        by_price = self.page(('price', 'id')).next_cursor()
+        for bad in (cursor[:-2] + 'xx', 'garbage', by_price):
+            with self.subTest(bad):
+                page = self.page(latest, bad)
+                self.assertEqual([product.id for product in page], first)
+                self.assertFalse(page.has_previous)
+
+    def test_deep_pages_seek_instead_of_offset(self):
+        ordering = ('-added_at', '-id')
+        pages = self.walk(ordering)
+        with CaptureQueriesContext(connection) as queries:
+            list(self.page(ordering, pages[1].next_cursor()))
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+
+    def test_staff_product_page(self):
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_login(staff)
+
+        response = self.client.get('/product', {'order': 'price'})
+        page = response.context['product_page']
+        self.assertEqual(len(page), 25)
+        self.assertContains(response, f'order=price&cursor={page.next_cursor()}'.replace(':', '%3A'))
+
+        response = self.client.get('/product', {'order': 'price', 'cursor': page.next_cursor()})
+        self.assertEqual(response.context['product_page'].object_list[0].price, Decimal('2'))
+
+    def test_product_type_listing_is_paged(self):
+        response = self.client.get(f'/product_type/{self.shoes.pk}/')
+        page = response.context['products']
+        self.assertEqual(len(page), 24)
+
+        response = self.client.get(f'/product_type/{self.shoes.pk}/', {'cursor': page.next_cursor()})
+        next_page = response.context['products']
+        self.assertTrue(next_page.has_previous)
+        self.assertContains(response, next_page.object_list[0].name)
+        self.assertNotContains(response, f'>{page.object_list[0].name}<')
+
+    def test_bad_cursors_share_the_first_page_cache_entry(self):
+        url = f'/product_type/{self.shoes.pk}/'
+        with mock.patch('store.keyset.cached', wraps=catalog_cache.cached) as cached:
+            for cursor in ('garbage', 'more garbage', ''):
+                self.client.get(url, {'cursor': cursor})
+        self.assertEqual({call.args[2:] for call in cached.call_args_list}, {(self.shoes.pk, '')})
+
+    def test_cached_pages_link_from_the_current_request(self):
+        url = f'/product_type/{self.shoes.pk}/'
+        self.client.get(url, {'utm_source': 'mail'})
+        response = self.client.get(url)
+        self.assertContains(response, '?cursor=')
+        self.assertNotContains(response, 'utm_source')
+
+
+class CatalogApiTests(TestCase):
+    def setUp(self):
+        catalog_cache.bump_catalog_version()
+        self.shoes = ProductType.objects.create(name='Shoes')
+        self.men = Category.objects.create(name='Men')
+        Product.objects.bulk_create([
+            Product(name=f'Item {i}', product_type=self.shoes, category=self.men, description='x' * 4000,
+                    original_price=Decimal('90.00'), price=Decimal(i + 1))
+            for i in range(60)
+        ])
+
+    def test_product_list_is_compact_and_paged(self):
+        response = self.client.get('/api/v1/products/', {'order': 'price'})
+        data = response.json()
+        self.assertEqual(len(data['results']), 50)
+        self.assertNotIn('description', data['results'][0])
+        self.assertEqual(data['results'][0]['price'], '1.00')
+        self.assertIsNone(data['previous'])
+
+        data = self.client.get(data['next']).json()
+        self.assertEqual([product['price'] for product in data['results']], [f'{i}.00' for i in range(51, 61)])
+        self.assertIsNone(data['next'])
+        self.assertEqual(len(self.client.get(data['previous']).json()['results']), 50)
+
+        response = self.client.get('/api/v1/products/', {'price_min': 'cheap'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('price', response.json()['errors'])
+
+    def test_product_detail(self):
+        product = Product.objects.get(name='Item 3')
+        data = self.client.get(f'/api/v1/products/{product.pk}/').json()
+        self.assertEqual(data['description'], 'x' * 4000)
+        self.assertEqual(data['product_type'], self.shoes.pk)
+        self.assertEqual(self.client.get('/api/v1/products/99999/').status_code, 404)
+
+    def test_groups(self):
+        self.assertEqual(self.client.get('/api/v1/product-types/').json()['results'][0]['name'], 'Shoes')
+        self.assertEqual(self.client.get('/api/v1/categories/').json()['results'][0]['id'], self.men.pk)
+
+    def test_unchanged_catalog_answers_not_modified(self):
+        url = '/api/v1/products/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name='Item 0').get().save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_errors_are_not_validated(self):
+        etag = self.client.get('/api/v1/products/')['ETag']
+        for url, status in (('/api/v1/products/99999/', 404), ('/api/v1/products/?price_min=cheap', 400)):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status)
+            self.assertFalse(response.has_header('ETag'))
+        for url, status in (('/api/v1/products/99999/', 404), ('/api/v1/products/?price_min=abc', 400),
+                            ('/api/v1/products/?order=bogus', 400)):
+            for match in (etag, '*'):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=match).status_code, status)
+
+        product = Product.objects.get(name='Item 3')
+        response = self.client.get(f'/api/v1/products/{product.pk}/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_repeat_requests_are_served_from_cache(self):
+        self.client.get('/api/v1/products/', {'category': self.men.pk})
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/products/', {'category': self.men.pk})
+        self.assertEqual(len(response.json()['results']), 50)
+
+    def test_cache_is_keyed_by_the_accepted_parameters(self):
+        self.client.get('/api/v1/products/', {'category': self.men.pk, 'junk': 'a'})
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/products/', {'junk': 'b', 'category': self.men.pk, 'cursor': 'bad'})
+        data = response.json()
+        self.assertEqual(len(data['results']), 50)
+        self.assertNotIn('junk', data['next'])
+        self.assertIn(f'category={self.men.pk}', data['next'])
+
+        self.client.get('/api/v1/products/', {'price_min': '10'})
+        with self.assertNumQueries(0):
+            data = self.client.get('/api/v1/products/', {'price_min': '10.00'}).json()
+        self.assertIn('price_min=10&', data['next'])
+
+    def test_read_only(self):
+        self.assertEqual(self.client.post('/api/v1/products/').status_code, 405)
+
+
+class ConditionalPageTests(TestCase):
+    def setUp(self):
+        self.shoes = ProductType.objects.create(name='Shoes')
+        self.boot = Product.objects.create(
+            name='Leather boot', product_type=self.shoes, original_price=Decimal('30.00'), price=Decimal('20.00'),
+        )
+        self.sandal = Product.objects.create(
+            name='Beach sandal', product_type=self.shoes, original_price=Decimal('12.00'), price=Decimal('8.00'),
+        )
+        self.urls = [f'/product_detail/{self.boot.pk}/', f'/product_type/{self.shoes.pk}/']
+
+    def revalidate(self, url, response, **headers):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], **headers)
+
+    def test_updated_at_is_maintained(self):
+        before = self.boot.updated_at
+        self.boot.price = Decimal('18.00')
+        self.boot.save()
+        self.assertGreater(self.boot.updated_at, before)
+        self.assertEqual(self.boot.added_at, Product.objects.get(pk=self.boot.pk).added_at)
+
+    def test_unchanged_page_is_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url):
+                response = self.client.get(url)
+                self.assertTrue(response['ETag'].startswith('W/"'))
+                self.assertIn('Last-Modified', response)
+                self.assertIn('private', response['Cache-Control'])
+
+                # Only the two freshness queries: no session, no page queries, no template
+                with self.assertNumQueries(2):
+                    again = self.revalidate(url, response)
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again.content, b'')
+                self.assertNotIn('Content-Security-Policy', again)
+
+                again = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(again.status_code, 304)
+
+    def test_changes_to_shown_rows_refresh_the_page(self):
+        url = f'/product_detail/{self.boot.pk}/'
+        changes = [
+            lambda: self.boot.save(),
+            lambda: self.sandal.save(),
+            lambda: self.shoes.save(),
+            lambda: Product.objects.create(name='Clog', product_type=self.shoes,
+                                           original_price=Decimal('9.00'), price=Decimal('7.00')),
+            lambda: Product.objects.filter(name='Clog').delete(),
+        ]
+        for change in changes:
+            response = self.client.get(url)
+            change()
+            self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_visitor_state_is_part_of_the_etag(self):
+        url = f'/product_type/{self.shoes.pk}/'
+        response = self.client.get(url)
+        self.client.cookies['cart'] = json.dumps({str(self.boot.pk): {'quantity': 1}})
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+        response = self.client.get(url)
+        self.client.force_login(User.objects.create_user('browser', password='secret'))
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_cookieless_visitors_revalidate_without_a_session(self):
+        url = f'/product_detail/{self.boot.pk}/'
+        etag = Client().get(url)['ETag']
+        response = Client().get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(Session.objects.exists())
+
+    def test_missing_rows_fall_through_to_the_view(self):
+        response = self.client.get('/product_type/999/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.shoes = ProductType.objects.create(name='Shoes')
+        self.boot = Product.objects.create(
+            name='Leather boot', product_type=self.shoes, original_price=Decimal('30.00'), price=Decimal('20.00'),
+        )
+        # Creating the boot told customers about it
+        Notification.objects.all().delete()
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def run_import(self, path, **options):
+        out = StringIO()
+        call_command('import_products', path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_csv_import_creates_updates_and_rejects(self):
+        path = self.write('catalog.csv', (
+            'name,product_type,category,description,original_price,price,shipping,digital\n'
+            'LEATHER BOOT,shoes,,Now in brown,30.00,18.50,2.00,no\n'
+            'Running shoe,Shoes,Sport,,45.00,40.00,,\n'
+            'Yoga mat,Fitness,Sport,Non-slip,15.00,12.00,1.00,0\n'
+            'Broken price,Shoes,,,abc,1.00,,\n'
+            ',Shoes,,,1.00,1.00,,\n'
+        ))
+        version = catalog_cache.catalog_version()
+        self.run_import(path)
+
+        self.boot.refresh_from_db()
+        self.assertEqual((self.boot.name, self.boot.price), ('LEATHER BOOT', Decimal('18.50')))
+        self.assertEqual(self.boot.product_type, self.shoes)
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(ProductType.objects.filter(name='Fitness').count(), 1)
+        self.assertEqual(Category.objects.filter(name='Sport').count(), 1)
+        self.assertEqual(Product.objects.get(name='Running shoe').category.name, 'Sport')
+        self.assertNotEqual(catalog_cache.catalog_version(), version)
+        self.assertEqual(ProductSearch('yoga').count(), 1)
+        # One notification for the import rather than one per product
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertIn('2 new products', Notification.objects.get().message)
+
+        with open(f'{path}.rejected.csv', encoding='utf-8') as f:
+            rejects = list(csv.DictReader(f))
+        self.assertEqual([row['line'] for row in rejects], ['5', '6'])
+        self.assertIn('original_price', rejects[0]['error'])
+        self.assertIn('name', rejects[1]['error'])
+
+    def test_unchanged_rows_are_left_alone(self):
+        path = self.write('catalog.jsonl', json.dumps({
+            'name': 'Leather boot', 'product_type': 'Shoes', 'original_price': '30.00', 'price': '20.00',
+        }) + '\n')
+        updated_at = self.boot.updated_at
+
+        output = self.run_import(path)
+
+        self.assertIn('left 1 unchanged', output)
+        self.boot.refresh_from_db()
+        self.assertEqual(self.boot.updated_at, updated_at)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_jsonl_rejects_invalid_lines(self):
+        path = self.write('catalog.jsonl', (
+            '{"name": "Sandal", "product_type": "Shoes", "original_price": 10, "price": 8, "digital": true}\n'
+            '{"name": "Clog",\n'
+            '["not", "an", "object"]\n'
+        ))
+        self.run_import(path, rejects=os.path.join(self.dir, 'bad.jsonl'), no_notify=True)
+
+        self.assertTrue(Product.objects.get(name='Sandal').digital)
+        self.assertFalse(Notification.objects.exists())
+        with open(os.path.join(self.dir, 'bad.jsonl'), encoding='utf-8') as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual([row['line'] for row in rejects], [2, 3])
+        self.assertTrue(rejects[0]['error'].startswith('Invalid JSON'))
+
+    def test_export_round_trips_through_import(self):
+        Product.objects.create(name='E-book', category=Category.objects.create(name='Books'), digital=True,
+                               original_price=Decimal('5.00'), price=Decimal('4.00'))
+        fields = ('name', 'product_type__name', 'category__name', 'price', 'digital')
+        before = sorted(Product.objects.values_list(*fields))
+
+        for fmt in ('csv', 'jsonl'):
+            with self.subTest(fmt):
+                path = os.path.join(self.dir, f'export.{fmt}')
+                call_command('export_products', path, stdout=StringIO())
+                Product.objects.all().delete()
+                self.run_import(path, no_notify=True)
+                self.assertEqual(sorted(Product.objects.values_list(*fields)), before)
+
+    def test_unknown_format_is_an_error(self):
+        with self.assertRaises(CommandError):
+            self.run_import(self.write('catalog.xml', ''))
+
+
+class SalesSummaryTests(GuestCheckoutMixin, TestCase):
+    def setUp(self):
+        self.books = Category.objects.create(name='Books')
+        self.novel = Product.objects.create(name='Novel', category=self.books, original_price=Decimal('15.00'),
+                                            price=Decimal('10.00'), shipping=Decimal('1.00'))
+        self.pen = Product.objects.create(name='Pen', original_price=Decimal('3.00'), price=Decimal('2.00'))
+
+    def summaries(self):
+        return (
+            list(DailySales.objects.values_list('date', 'orders', 'items', 'revenue')),
+            sorted(ProductSales.objects.values_list('product', 'orders', 'quantity', 'revenue')),
+            list(CategorySales.objects.values_list('category', 'orders', 'quantity', 'revenue')),
+        )
+
+    def test_checkout_updates_the_summaries(self):
+        self.guest_checkout({self.novel: 2, self.pen: 1}, '23.00')
+        self.guest_checkout({self.novel: 1}, '11.00')
+        # A total that does not match leaves the order open and out of the summaries
+        self.guest_checkout({self.pen: 5}, '1.00')
+
+        today = timezone.localdate()
+        self.assertEqual(self.summaries(), (
+            [(today, 2, 4, Decimal('34.00'))],
+            [(self.novel.pk, 2, 3, Decimal('32.00')), (self.pen.pk, 1, 1, Decimal('2.00'))],
+            [(self.books.pk, 2, 3, Decimal('32.00'))],
+        ))
+        self.assertIsNotNone(Order.objects.filter(complete=True).first().completed_at)
+
+    def test_rebuild_matches_incremental_updates(self):
+        self.guest_checkout({self.novel: 2, self.pen: 1}, '23.00')
+        self.guest_checkout({self.pen: 3}, '6.00')
+        incremental = self.summaries()
+
+        out = StringIO()
+        call_command('rebuild_sales_summaries', stdout=out)
+
+        self.assertEqual(self.summaries(), incremental)
+        self.assertIn('1 days and 2 products', out.getvalue())
+
+    def test_rebuild_counts_history_by_order_date(self):
+        order = Order.objects.create(complete=True, cart_total=Decimal('21.00'), cart_items=2)
+        OrderItem.objects.create(order=order, product=self.novel, quantity=2, line_total=Decimal('21.00'))
+        placed = timezone.now() - timezone.timedelta(days=3)
+        Order.objects.filter(pk=order.pk).update(date_ordered=placed)
+
+        call_command('rebuild_sales_summaries', stdout=StringIO())
+
+        self.assertEqual(self.summaries()[0], [(timezone.localdate(placed), 1, 2, Decimal('21.00'))])
+
+    def test_report_reads_only_the_summaries(self):
+        self.guest_checkout({self.novel: 2, self.pen: 1}, '23.00')
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_login(staff)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/sales/?days=7')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['daily']), 7)
+        self.assertEqual(response.context['revenue'], Decimal('23.00'))
+        self.assertEqual([row.product for row in response.context['top_products']], [self.novel, self.pen])
+        self.assertEqual([row.category for row in response.context['categories']], [self.books])
+        # Nothing reads the order history; the navbar's cart badge only looks at the open cart
+        tables = ' '.join(query['sql'] for query in queries.captured_queries
+                          if 'NOT "store_order"."complete"' not in query['sql'])
+        self.assertNotIn('"store_order"', tables)
+        self.assertNotIn('"store_orderitem"', tables)
+
+    def test_report_is_staff_only(self):
+        response = self.client.get('/sales/')
+        self.assertEqual(response.status_code, 302)
+
+
+class CoPurchaseRecommendationTests(GuestCheckoutMixin, TestCase):
+    def setUp(self):
+        self.shoes = ProductType.objects.create(name='Shoes')
+        self.boot, self.sandal, self.clog = [
+            Product.objects.create(name=name, product_type=self.shoes, original_price=Decimal('12.00'),
+                                   price=Decimal('10.00'))
+            for name in ('Boot', 'Sandal', 'Clog')
+        ]
+        self.polish, self.laces = [
+            Product.objects.create(name=name, original_price=Decimal('3.00'), price=Decimal('2.00'))
+            for name in ('Polish', 'Laces')
+        ]
+
+    def checkout(self, products):
+        return self.guest_checkout({p: 1 for p in products}, str(sum(p.price for p in products)))
+
+    def pairs(self):
+        return sorted(CoPurchase.objects.values_list('product', 'related_product', 'score'))
+
+    def test_checkout_counts_products_bought_together(self):
+        self.checkout([self.boot, self.polish, self.laces])
+        self.checkout([self.boot, self.laces])
+        self.checkout([self.sandal])
+
+        boot, polish, laces = self.boot.pk, self.polish.pk, self.laces.pk
+        self.assertEqual(self.pairs(), sorted([
+            (boot, polish, 1), (polish, boot, 1), (boot, laces, 2), (laces, boot, 2),
+            (polish, laces, 1), (laces, polish, 1),
+        ]))
+
+    def test_rebuild_matches_checkout_and_trims(self):
+        self.checkout([self.boot, self.polish, self.laces])
+        self.checkout([self.boot, self.laces])
+        incremental = self.pairs()
+
+        out = StringIO()
+        call_command('rebuild_co_purchases', stdout=out)
+        self.assertEqual(self.pairs(), incremental)
+        self.assertIn('Indexed 6', out.getvalue())
+
+        with mock.patch('store.recommendations.RELATED_PER_PRODUCT', 1):
+            call_command('rebuild_co_purchases', stdout=StringIO())
+        self.assertEqual(
+            list(CoPurchase.objects.filter(product=self.boot).values_list('related_product', flat=True)),
+            [self.laces.pk],
+        )
+
+    def test_detail_page_recommends_co_purchases_then_same_type(self):
+        self.checkout([self.boot, self.polish, self.laces])
+        self.checkout([self.boot, self.laces])
+
+        response = self.client.get(f'/product_detail/{self.boot.pk}/')
+
+        explore = response.context['explore_products']
+        self.assertEqual(explore[:2], [self.laces, self.polish])
+        # Too few co-purchases, so the rest come from the product's own type
+        self.assertEqual(set(explore[2:]), {self.sandal, self.clog})
+
+    def test_new_co_purchases_refresh_the_detail_page(self):
+        url = f'/product_detail/{self.polish.pk}/'
+        response = self.client.get(url)
+        self.checkout([self.polish, self.laces])
+        self.client.cookies.pop('cart')
+
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.context['explore_products'], [self.laces])
+
+
+class ConcurrentCartTests(GuestCheckoutMixin, TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        # Threads of an in-memory SQLite database share one cache and lock each other's tables
+        if connection.is_in_memory_db():
+            self.skipTest('needs a file-based test database')
+
+    def test_parallel_increments_are_not_lost(self):
+        user = User.objects.create_user('buyer', password='secret')
+        customer = Customer.objects.create(user=user, name='Buyer')
+        product = Product.objects.create(name='Shirt', original_price=Decimal('9.00'), price=Decimal('5.00'))
+        Order.objects.create(customer=customer, complete=False)
+        applyCartOperations(customer, {product.id: ('add', 1)})
+
+        def increment():
+            try:
+                for _ in range(5):
+                    applyCartOperations(customer, {product.id: ('add', 1)})
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        line = OrderItem.objects.get()
+        self.assertEqual(line.quantity, 41)
+        self.assertEqual(line.line_total, Decimal('205.00'))
+        self.assertEqual(Order.objects.get().cart_items, 41)
+
+    def test_parallel_first_adds_share_one_cart_and_line(self):
+        user = User.objects.create_user('buyer', password='secret')
+        customer = Customer.objects.create(user=user, name='Buyer')
+        product = Product.objects.create(name='Shirt', original_price=Decimal('9.00'), price=Decimal('5.00'))
+
+        def add():
+            try:
+                applyCartOperations(customer, {product.id: ('add', 1)})
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Order.objects.get().cart_items, 8)
+        self.assertEqual(OrderItem.objects.get().quantity, 8)
+
+    def test_parallel_guest_checkouts_all_complete(self):
+        product = Product.objects.create(name='Shirt', original_price=Decimal('9.00'), price=Decimal('5.00'))
+        statuses = []
+
+        def checkout():
+            try:
+                statuses.append(self.guest_checkout({product: 1}, '5.00', client=Client()).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 8)
+        self.assertEqual(Order.objects.filter(complete=True).count(), 8)
+        self.assertEqual(Customer.objects.count(), 1)
@@ -1,5 +1,5 @@
-from django.urls import path
-from . import views
+from django.urls import include, path
+from . import api, views
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -7,10 +7,12 @@ urlpatterns = [
     path('cart/', views.cart, name='cart'),
     path('shop/', views.shop, name='shop'),
     path('order/', views.order, name='order'),
+    path('sales/', views.sales, name='sales'),
     path('contact/', views.contact, name='contact'),
     path('checkout/', views.checkout, name='checkout'),
     path('clear_cart/', views.clear_cart, name='clear_cart'),
     path('update_item/', views.update_item, name='update_item'),
+    path('update_cart/', views.update_cart, name='update_cart'),
     path('process_order/', views.processOrder, name='process_order'),
     path('product_detail/<str:product_id>/', views.productDetail, name='product_detail'),
     path('product_type/<str:pk>/', views.product_type_detail, name='product_type_detail'),
@@ -19,5 +21,6 @@ urlpatterns = [
     path('updateProduct/<str:product_id>/', views.updateProduct, name='updateProduct'),
     path('addCategory', views.addCategory, name='addCategory'),
     path('addProductType', views.addProductType, name='addProductType'),
+    path(f'api/{api.API_VERSION}/', include('store.api_urls')),
 
 ]
@@ -1,56 +1,189 @@
 import json
+import random
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce
+from . import images
+from .db import lock_for_write
 from .models import *
 
+# Seeded listing order: products sort by ((id * seed) mod p)^2 mod p. For ids
+# below p / 2 that key is distinct per product, stable for a given seed, and
+# cheap for the database to compute without loading the catalog
+SHUFFLE_MODULUS = 2147483647
 
-def cookieCart(request):
+
+def parseCart(raw):
+    # Normalise the cart cookie into {product_id: quantity}, dropping malformed lines
     try:
-        cart = json.loads(request.COOKIES['cart'])
-    except:
-        cart = {}
+        cart = json.loads(raw) if raw else {}
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(cart, dict):
+        return {}
+
+    lines = {}
+    for key, line in cart.items():
+        try:
+            product_id = int(key)
+            quantity = int(line['quantity'])
+        except (TypeError, ValueError, KeyError):
+            continue
+        if quantity > 0:
+            lines[product_id] = lines.get(product_id, 0) + quantity
+    return lines
+
 
-    print('Cart:', cart)
+def priceCart(lines):
+    # Resolve a whole cart in one projected query, including the related names
     items = []
     order = {'get_cart_total': 0, 'get_cart_items': 0, 'shipping': False}
+    if not lines:
+        return order, items
+
+    storage = Product._meta.get_field('image').storage
+    rows = Product.objects.filter(id__in=lines).values(
+        'id', 'name', 'price', 'shipping', 'digital', 'image',
+        'product_type__name', 'category__name',
+    )
+    for row in rows:
+        quantity = lines[row['id']]
+        total = (row['price'] * quantity) + row['shipping']
+
+        order['get_cart_total'] += total
+        order['get_cart_items'] += quantity
+
+        items.append({
+            'product': {
+                'id': row['id'],
+                'name': row['name'],
+                'type': row['product_type__name'],
+                'category': row['category__name'],
+                'price': row['price'],
+                'shipping': row['shipping'],
+                'digital': row['digital'],
+                'imageURL': storage.url(row['image']) if row['image'] else '',
+                'thumbnailURL': images.derivative_url(storage, row['image'], images.WIDTHS[0]),
+            },
+            'quantity': quantity,
+            'get_total': total,
+        })
+
+        if row['digital'] == False:
+            order['shipping'] = True
+
+    # Keep the cookie's line order rather than the database's
+    position = {product_id: index for index, product_id in enumerate(lines)}
+    items.sort(key=lambda item: position[item['product']['id']])
+    return order, items
+
+
+def cookieCart(request):
+    lines = parseCart(request.COOKIES.get('cart'))
+    order, items = priceCart(lines)
     cartItems = order['get_cart_items']
 
-    for i in cart:
+    return {'cartItems': cartItems, 'order': order, 'items': items}
+
+CART_ACTIONS = {'add': 1, 'remove': -1}
+
+
+def parseCartOperations(operations):
+    # Coalesce [{productId, action|quantity}, ...] into {product_id: ('add' | 'set', amount)},
+    # applying the operations for each product in the order they were sent
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('operations must be a non-empty list')
+
+    changes = {}
+    for operation in operations:
         try:
-            cartItems += cart[i]["quantity"]
-
-            product = Product.objects.get(id=i)
-            total = ((product.price * cart[i]["quantity"]) + product.shipping)
-
-            order['get_cart_total'] += total
-            order['get_cart_items'] += cart[i]["quantity"]
-
-            item = {
-                'product': {
-                    'id': product.id,
-                    'name': product.name,
-                    'type': product.product_type,
-                    'category': product.category,
-                    'price': product.price,
-                    'shipping': product.shipping,
-                    'imageURL': product.imageURL,
-                },
-                'quantity': cart[i]["quantity"],
-                'get_total': total
-            }
-            items.append(item)
-
-            if product.digital == False:
-                order['shipping'] = True
-
-        except:
-            pass
+            product_id = int(operation['productId'])
+            if 'quantity' in operation:
+                quantity = int(operation['quantity'])
+                if quantity < 0:
+                    raise ValueError
+                changes[product_id] = ('set', quantity)
+            else:
+                mode, amount = changes.get(product_id, ('add', 0))
+                changes[product_id] = (mode, amount + CART_ACTIONS[operation['action']])
+        except (TypeError, ValueError, KeyError):
+            raise ValueError(f'Invalid cart operation: {operation!r}')
+    return changes
+
+
+def applyCartOperations(customer, changes):
+    products = Product.objects.in_bulk(list(changes))
+    missing = sorted(set(changes) - set(products))
+    if missing:
+        raise ValueError(f'Unknown product ids: {missing}')
+
+    with transaction.atomic():
+        lock_for_write(Order)
+        order, created = Order.objects.select_for_update().get_or_create(customer=customer, complete=False)
+
+        # Make sure every product being added has a line, then change them all in
+        # the database, so concurrent requests cannot add a second line or lose updates
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=products[product_id], quantity=0,
+                      price=products[product_id].price, shipping=products[product_id].shipping)
+            for product_id, (mode, amount) in changes.items() if amount > 0
+        ], ignore_conflicts=True)
+
+        for product_id, (mode, amount) in changes.items():
+            product = products[product_id]
+            price = Coalesce(F('price'), Value(product.price), output_field=DecimalField())
+            shipping = Coalesce(F('shipping'), Value(product.shipping), output_field=DecimalField())
+            if mode == 'add':
+                quantity = Coalesce(F('quantity'), 0) + amount
+            else:
+                quantity = Value(amount)
+
+            OrderItem.objects.filter(order=order, product=product).update(
+                quantity=quantity,
+                price=price,
+                shipping=shipping,
+                line_total=ExpressionWrapper(price * quantity + shipping, output_field=DecimalField()),
+            )
+
+        order.orderitem_set.filter(quantity__lte=0).delete()
+        order.recompute_totals()
+
+    order.refresh_from_db(fields=['cart_total', 'cart_items', 'needs_shipping'])
+    return order
+
+
+def cartSummary(order):
+    lines = order.orderitem_set.values_list('product_id', 'quantity', 'line_total')
+    return {
+        'cartItems': order.cart_items,
+        'cartTotal': str(order.cart_total),
+        'shipping': order.needs_shipping,
+        'items': [
+            {'productId': product_id, 'quantity': quantity, 'total': str(total)}
+            for product_id, quantity, total in lines
+        ],
+    }
+
+
+def cartCount(request):
+    # Navbar badge only: one aggregate for customers, one id lookup for guests, no writes
+    if request.user.is_authenticated:
+        totals = Order.objects.filter(customer__user=request.user, complete=False).aggregate(items=Sum('cart_items'))
+        return totals['items'] or 0
+    lines = parseCart(request.COOKIES.get('cart'))
+    if not lines:
+        return 0
+    # Lines for products that no longer exist are dropped, as priceCart drops them
+    found = Product.objects.filter(id__in=list(lines)).values_list('id', flat=True)
+    return sum(lines[product_id] for product_id in found)
 
-    return {'cartItems': cartItems, 'order': order, 'items': items}
 
 def cartData(request):
     if request.user.is_authenticated:
         customer = request.user.customer
         order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        items = order.orderitem_set.all()
+        items = order.orderitem_set.select_related('product')
         cartItems = order.get_cart_items
     else:
         cookieData = cookieCart(request)
@@ -61,9 +194,6 @@ def cartData(request):
 
 
 def guestOrder(request, data):
-    print('User is not logged in')
-
-    print('COOKIES:', request.COOKIES)
     name = data['form']['name']
     phone = data['form']['phone']
     email = data['form']['email']
@@ -71,24 +201,65 @@ def guestOrder(request, data):
     cookieData = cookieCart(request)
     items = cookieData['items']
 
-    customer, created = Customer.objects.get_or_create(
-        email=email,
+    customer, created = Customer.objects.update_or_create(
+        email=email, defaults={'name': name, 'phone': phone},
     )
-    customer.name = name
-    customer.phone = phone
-    customer.save()
 
+    totals = cookieData['order']
     order = Order.objects.create(
         customer=customer,
         complete=False,
+        cart_total=totals['get_cart_total'],
+        cart_items=totals['get_cart_items'],
+        needs_shipping=totals['shipping'],
     )
-    for item in items:
-        product = Product.objects.get(id=item['product']['id'])
-
-        orderitem = OrderItem.objects.create(
-            product=product,
+    # The lines were already priced by cookieCart, so they go in as one INSERT
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            product_id=item['product']['id'],
             order=order,
-            quantity=item['quantity']
+            quantity=item['quantity'],
+            price=item['product']['price'],
+            shipping=item['product']['shipping'],
+            line_total=item['get_total'],
         )
+        for item in items
+    ])
+
+    return customer, order
+
+
+# The seed of visitors who have none yet, for pages that must not start a session
+DEFAULT_SHUFFLE_SEED = 48271
+
+
+def shuffleSeed(request, create=True):
+    # One seed per session keeps shuffled listings stable from page to page
+    seed = request.session.get('shuffle_seed')
+    if not seed:
+        if not create:
+            return DEFAULT_SHUFFLE_SEED
+        seed = random.randrange(1, SHUFFLE_MODULUS)
+        request.session['shuffle_seed'] = seed
+    return seed
+
+
+def shuffled(queryset, seed):
+    scrambled = (F('id') * seed) % SHUFFLE_MODULUS
+    return queryset.annotate(
+        shuffle_key=(scrambled * scrambled) % SHUFFLE_MODULUS
+    ).order_by('shuffle_key', 'id')
+
+
+def paginate(request, object_list, per_page, page_param='page'):
+    paginator = Paginator(object_list, per_page)
+    page = paginator.get_page(request.GET.get(page_param))
 
-    return customer, order
\ No newline at end of file
+    # Extras for store/pagination.html: a bounded set of page links and the
+    # rest of the query string, so filters survive moving between pages
+    params = request.GET.copy()
+    params.pop(page_param, None)
+    page.page_range = paginator.get_elided_page_range(page.number, on_each_side=2, on_ends=1)
+    page.page_query = params.urlencode()
+    page.page_param = page_param
+    return page
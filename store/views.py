@@ -1,4 +1,3 @@
-import random
 from django.contrib import messages
 from django.http import JsonResponse
 import json
@@ -7,10 +6,20 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.conf import settings
 from .models import *
 from .forms import *
-from .utils import cookieCart, cartData, guestOrder
+from .utils import cookieCart, cartData, guestOrder, shuffleSeed, shuffled, paginate, \
+    parseCartOperations, applyCartOperations, cartSummary
 from .filters import *
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from .search import search_products
+from .facets import facet_counts
+from .db import lock_for_write
+from .keyset import PRODUCT_ORDERINGS, LATEST_FIRST, QUICK_PRODUCTS, cached_page, keyset_paginate
+from .conditional import conditional_page, product_detail_freshness, product_type_freshness
+from .recommendations import record_co_purchases, recommended_products
+from .sales import DEFAULT_DAYS, REPORT_DAYS, record_sale, sales_report
 from django.contrib.auth.decorators import user_passes_test
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
 
 
 # Create your views here.
@@ -18,27 +27,23 @@ def is_admin(user):
     return user.is_authenticated and user.is_staff
 
 
-def index(request):
-    data = cartData(request)
-    cartItems = data['cartItems']
-
-    product_types = ProductType.objects.all()[:6]
-
-    products = Product.objects.all()
+def save_unique(form):
+    # Two submissions can both pass validation; the unique name constraint stops the second
+    try:
+        with transaction.atomic():
+            form.save()
+    except IntegrityError:
+        form.add_error(None, f"{form.cleaned_data.get('name')} already exist")
+        return False
+    return True
 
-    # Shuffle the products
-    products_list = list(products)
-    random.shuffle(products_list)
 
-    product_page = Paginator(products_list, 16)
-    page_number = request.GET.get('page')
+def index(request):
+    product_types = ProductType.objects.all()[:6]
 
-    try:
-        product_page = product_page.get_page(page_number)
-    except PageNotAnInteger:
-        product_page = product_page.page(1)
-    except EmptyPage:
-        product_page = product_page.page(product_page.num_pages)
+    # Shuffled per session; the database only returns the rows for this page
+    products = shuffled(Product.objects.all(), shuffleSeed(request))
+    product_page = paginate(request, products, 16)
 
     cheapest = Product.objects.order_by('price')[:10]
     latest_products = Product.objects.all().order_by('-added_at')[:12]
@@ -48,42 +53,32 @@ def index(request):
         'product_types': product_types,
         'cheapest': cheapest,
         'latest_products': latest_products,
-        'cartItems': cartItems,
     }
     return render(request, 'store/index.html', context)
 
 
+@conditional_page(product_type_freshness)
 def product_type_detail(request, pk):
-    data = cartData(request)
-    cartItems = data['cartItems']
-
     product_type = get_object_or_404(ProductType, pk=pk)
-    products = Product.objects.filter(product_type=product_type)
+    page = keyset_paginate(request, Product.objects.filter(product_type=product_type), LATEST_FIRST, 24)
+    products = cached_page('product_type_detail', page, product_type.pk)
 
     context = {
         'product_type': product_type,
         'products': products,
-        'cartItems': cartItems,
     }
     return render(request, 'store/product_type_detail.html', context)
 
 
 def categories(request):
-    data = cartData(request)
-    cartItems = data['cartItems']
-
-    products = Product.objects.all()
-    my_filter = ProductFilter(request.GET, queryset=products)
-    products = my_filter.qs
-
-    # Convert the queryset to a list and shuffle it
-    products_list = list(products)
-    random.shuffle(products_list)
+    my_filter = ProductFilter(request.GET, queryset=Product.objects.all())
+    products = shuffled(my_filter.qs, shuffleSeed(request))
+    product_page = paginate(request, products, 24)
 
     context = {
-        'cartItems': cartItems,
-        'products': products_list,  # Use the shuffled list
+        'product_page': product_page,
         'my_filter': my_filter,
+        'facets': facet_counts(request.GET),
     }
     return render(request, 'store/categories.html', context)
 
@@ -125,31 +120,37 @@ def update_item(request):
     data = json.loads(request.body)
     productId = data['productId']
     action = data['action']
-    print('Action:', action)
-    print('ProductId:', productId)
 
     customer = request.user.customer
-    product = Product.objects.get(id=productId)
-    order, created = Order.objects.get_or_create(customer=customer, complete=False)
+    try:
+        changes = parseCartOperations([{'productId': productId, 'action': action}])
+        applyCartOperations(customer, changes)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-    orderItem, created = OrderItem.objects.get_or_create(order=order, product=product)
+    return JsonResponse('Item was added', safe=False)
 
-    if action == 'add':
-        orderItem.quantity = (orderItem.quantity + 1)
-    elif action == 'remove':
-        orderItem.quantity = (orderItem.quantity - 1)
-    orderItem.save()
 
-    if orderItem.quantity <= 0:
-        orderItem.delete()
+def update_cart(request):
+    # Apply a batch of {productId, action|quantity} edits atomically and return the new cart
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Guest carts are kept in the cart cookie'}, status=403)
 
-    return JsonResponse('Item was added', safe=False)
+    try:
+        data = json.loads(request.body)
+        changes = parseCartOperations(data.get('operations') if isinstance(data, dict) else None)
+        order = applyCartOperations(request.user.customer, changes)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse(cartSummary(order))
 
 
 def clear_cart(request):
     customer = request.user.customer
     cart_items = Order.objects.get(customer=customer, complete=False)
     cart_items.orderitem_set.all().delete()
+    cart_items.reset_totals()
 
     return JsonResponse('Cart was cleared', safe=False)
 
@@ -161,30 +162,42 @@ def processOrder(request):
     except json.JSONDecodeError as e:
         return JsonResponse({'error': f'Error decoding JSON: {e}'}, status=400)
 
-    if request.user.is_authenticated:
-        customer = request.user.customer
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-    else:
-        customer, order = guestOrder(request, data)
-
-    total = float(data['form']['total'])
-    order.transaction_id = transaction_id
-
-    if total == float(order.get_cart_total):
-        order.complete = True
-    order.save()
-
-    if order.shipping:
-        ShippingAddress.objects.create(
-            customer=customer,
-            order=order,
-            phone=data['shipping']['phone'],
-            email=data['shipping']['email'],
-            address=data['shipping']['address'],
-            town=data['shipping']['town'],
-            lga=data['shipping']['lga'],
-            state=data['shipping']['state'],
-        )
+    # The whole checkout commits or rolls back together, so bad input never leaves half an order
+    try:
+        with transaction.atomic():
+            # Both branches read before they write
+            lock_for_write(Order)
+            if request.user.is_authenticated:
+                customer = request.user.customer
+                order, created = Order.objects.select_for_update().get_or_create(customer=customer, complete=False)
+            else:
+                customer, order = guestOrder(request, data)
+
+            total = float(data['form']['total'])
+            order.transaction_id = transaction_id
+
+            # The totals are stored on the order, so this comparison costs no queries
+            if total == float(order.get_cart_total):
+                order.complete = True
+                order.completed_at = timezone.now()
+            order.save(update_fields=['transaction_id', 'complete', 'completed_at'])
+            if order.complete:
+                record_sale(order)
+                record_co_purchases(order)
+
+            if order.shipping:
+                ShippingAddress.objects.create(
+                    customer=customer,
+                    order=order,
+                    phone=data['shipping']['phone'],
+                    email=data['shipping']['email'],
+                    address=data['shipping']['address'],
+                    town=data['shipping']['town'],
+                    lga=data['shipping']['lga'],
+                    state=data['shipping']['state'],
+                )
+    except (KeyError, TypeError, ValueError) as e:
+        return JsonResponse({'error': f'Invalid checkout data: {e!r}'}, status=400)
 
     return JsonResponse('Payment Complete', safe=False)
 
@@ -197,86 +210,95 @@ def shop(request):
         form = SearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data.get('query')
-            results = Product.objects.filter(name__icontains=query) | Product.objects.filter(
-                description__icontains=query)
+            results = paginate(request, search_products(query), 16, page_param='results_page')
     else:
         form = SearchForm()
 
-    data = cartData(request)
-    cartItems = data['cartItems']
-
-    products = Product.objects.all()
-    # Convert the queryset to a list and shuffle it
-    products_list = list(products)
-    random.shuffle(products_list)
+    products = shuffled(Product.objects.all(), shuffleSeed(request))
+    product_page = paginate(request, products, 24)
 
     context = {
-        'cartItems': cartItems,
-        'products': products_list,
+        'product_page': product_page,
         'results': results,
         'form': form,
     }
     return render(request, 'store/shop.html', context)
 
 
+@conditional_page(product_detail_freshness)
 def productDetail(request, product_id):
     product_detail = Product.objects.get(id=product_id)
-    quick_products = Product.objects.all()[:8]
+    quick_products = Product.objects.order_by('pk')[:QUICK_PRODUCTS]
 
-    explore_products = Product.objects.filter(product_type=product_detail.product_type).exclude(id=product_detail.id)[
-                       :12]
-    # Convert the queryset to a list and shuffle it
-    products_list = list(explore_products)
-    random.shuffle(products_list)
+    # Reads the visitor's seed without starting a session, so cookieless revalidation can get a 304
+    explore_products = recommended_products(product_detail.id, shuffleSeed(request, create=False))
 
-    data = cartData(request)
-    cartItems = data['cartItems']
     context = {
-        'cartItems': cartItems,
         'product_detail': product_detail,
         'quick_products': quick_products,
-        'explore_products': products_list,
+        'explore_products': explore_products,
     }
     return render(request, 'store/product_detail.html', context)
 
 
 @user_passes_test(is_admin)
 def order(request):
-    data = cartData(request)
-    cartItems = data['cartItems']
-
-    orders = Order.objects.all().order_by('-date_ordered')
+    # A fixed number of queries per page: the orders with their customers, then
+    # every line (with its product) and shipping address for that page at once
+    orders = Order.objects.select_related('customer').prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product')),
+        'shippingaddress_set',
+    ).order_by('-date_ordered', '-id')
+    my_filter = OrderFilter(request.GET, queryset=orders)
+    order_page = paginate(request, my_filter.qs, 12)
 
     context = {
-        'cartItems': cartItems,
-        'orders': orders,
+        'orders': order_page,
+        'my_filter': my_filter,
     }
     return render(request, 'store/orders.html', context)
 
 
-def contact(request):
-    data = cartData(request)
-    cartItems = data['cartItems']
+@user_passes_test(is_admin)
+def sales(request):
+    # Reads only the summary tables, so it costs the same however long the order history is
+    try:
+        days = int(request.GET.get('days', DEFAULT_DAYS))
+    except ValueError:
+        days = DEFAULT_DAYS
+    if days not in REPORT_DAYS:
+        days = DEFAULT_DAYS
 
     context = {
-        'cartItems': cartItems,
+        **sales_report(days),
+        'days': days,
+        'report_days': REPORT_DAYS,
     }
-    return render(request, 'store/contact.html', context)
+    return render(request, 'store/sales.html', context)
+
+
+def contact(request):
+    return render(request, 'store/contact.html')
 
 
 @user_passes_test(is_admin)
 def product(request):
-    data = cartData(request)
-    cartItems = data['cartItems']
+    my_filter = ProductPage(request.GET, queryset=Product.objects.all())
+    order = request.GET.get('order')
+    if order not in PRODUCT_ORDERINGS:
+        order = 'latest'
+    product_page = keyset_paginate(request, my_filter.qs, PRODUCT_ORDERINGS[order], 25)
 
-    products = Product.objects.all()
-    my_filter = ProductPage(request.GET, queryset=products)
-    products = my_filter.qs
+    # A cursor belongs to one ordering, so changing it starts from the first page
+    params = request.GET.copy()
+    params.pop(product_page.cursor_param, None)
+    params.pop('order', None)
 
     context = {
-        'cartItems': cartItems,
-        'products': products,
+        'product_page': product_page,
         'my_filter': my_filter,
+        'order': order,
+        'sort_query': params.urlencode(),
     }
     return render(request, 'store/product.html', context)
 
@@ -286,8 +308,7 @@ def addProduct(request):
     form = AddProductForm()
     if request.method == 'POST':
         form = AddProductForm(request.POST, request.FILES)
-        if form.is_valid():
-            form.save()
+        if form.is_valid() and save_unique(form):
             messages.success(request, 'Product added successfully.')
             return redirect('product')  # Update 'home' to your home page URL name
         else:
@@ -306,8 +327,7 @@ def updateProduct(request, product_id):
 
     if request.method == "POST":
         form = UpdateProductForm(request.POST, request.FILES, instance=products)
-        if form.is_valid():
-            form.save()
+        if form.is_valid() and save_unique(form):
             messages.success(request, 'Product updated successfully.')
             return redirect('product')
         else:
@@ -325,8 +345,7 @@ def addCategory(request):
     form = CategoryForm
     if request.method == 'POST':
         form = CategoryForm(request.POST, request.FILES)
-        if form.is_valid():
-            form.save()
+        if form.is_valid() and save_unique(form):
             messages.success(request, 'New Category Added successfully.')
             return redirect('product')
         else:
@@ -346,8 +365,7 @@ def addProductType(request):
     form = ProductTypeForm
     if request.method == 'POST':
         form = ProductTypeForm(request.POST, request.FILES)
-        if form.is_valid():
-            form.save()
+        if form.is_valid() and save_unique(form):
             messages.success(request, 'New Product Type Added successfully.')
             return redirect('product')
         else: